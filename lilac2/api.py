@@ -5,10 +5,14 @@ import shutil
 import re
 import os
 import subprocess
+import sys
+import importlib.util
+import threading
+import tempfile # noqa: F401 # for lilac.py files
 from typing import Dict, List, Union
 from typing import Tuple, Optional, Iterable, Iterator
+from typing import TYPE_CHECKING, Any, cast
 import fileinput
-import tempfile
 from pathlib import Path
 from types import SimpleNamespace
 import tarfile
@@ -17,19 +21,17 @@ from contextlib import suppress
 from collections.abc import Container
 from urllib.parse import quote
 
-import httpx
-
 from .vendor.myutils import at_dir, file_lock
-from .vendor.htmlutils import parse_document_from_httpx
 
 from .cmd import git_push, git_pull, UNTRUSTED_PREFIX
 from .cmd import run_cmd as _run_cmd
 from . import const, intl
 from .const import _G, SPECIAL_FILES
 from .typing import PkgRel, Cmd
-from .pypi2pkgbuild import gen_pkgbuild
-from . import mediawiki2pkgbuild
-from .pkgbuild import get_srcinfo
+from .pkgbuild import get_srcinfo, evaluate_pkgbuild
+
+if TYPE_CHECKING:
+  import httpx
 
 git_push
 git_pull
@@ -41,7 +43,81 @@ _g = SimpleNamespace()
 logging.getLogger('httpcore').setLevel(logging.ERROR)
 logging.getLogger('hpack').setLevel(logging.ERROR)
 
-s = httpx.Client(http2=True)
+# Every build imports this module (and lilaclib does `from lilac2.api import *`),
+# while few of them fetch anything or generate PKGBUILDs. The names below
+# stay available but what they need is imported on first use.
+
+def _lazy_module(name: str) -> Any:
+  '''a module that is executed when its attributes are first accessed'''
+  if (mod := sys.modules.get(name)) is not None:
+    return mod
+  spec = importlib.util.find_spec(name)
+  if spec is None or spec.loader is None:
+    raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+  loader = importlib.util.LazyLoader(spec.loader)
+  spec.loader = loader
+  mod = importlib.util.module_from_spec(spec)
+  sys.modules[name] = mod
+  loader.exec_module(mod)
+  parent, _, child = name.rpartition('.')
+  if parent:
+    setattr(sys.modules[parent], child, mod)
+  return mod
+
+if TYPE_CHECKING:
+  from . import mediawiki2pkgbuild
+else:
+  httpx = _lazy_module('httpx')
+  mediawiki2pkgbuild = _lazy_module(f'{__package__}.mediawiki2pkgbuild')
+
+def parse_document_from_httpx(*args, **kwargs):
+  from .vendor.htmlutils import parse_document_from_httpx
+  return parse_document_from_httpx(*args, **kwargs)
+
+def gen_pkgbuild(*args, **kwargs):
+  from .pypi2pkgbuild import gen_pkgbuild
+  return gen_pkgbuild(*args, **kwargs)
+
+class _LazyClient:
+  '''an httpx.Client created on first use'''
+
+  def __init__(self) -> None:
+    object.__setattr__(self, '_client', None)
+    object.__setattr__(self, '_user_agent', None)
+    object.__setattr__(self, '_lock', threading.Lock())
+
+  def set_user_agent(self, ua: str) -> None:
+    '''set the User-Agent without creating the client'''
+    with self._lock:
+      if self._client is None:
+        object.__setattr__(self, '_user_agent', ua)
+        return
+    self._client.headers['User-Agent'] = ua
+
+  def _get(self) -> httpx.Client:
+    # called from build threads
+    with self._lock:
+      if self._client is None:
+        client = httpx.Client(http2=True)
+        if self._user_agent:
+          client.headers['User-Agent'] = self._user_agent
+        object.__setattr__(self, '_client', client)
+      return self._client
+
+  def __getattr__(self, name: str) -> Any:
+    return getattr(self._get(), name)
+
+  def __setattr__(self, name: str, value: Any) -> None:
+    setattr(self._get(), name, value)
+
+  def __enter__(self) -> httpx.Client:
+    return self._get().__enter__()
+
+  def __exit__(self, *args: Any) -> None:
+    self._get().__exit__(*args)
+
+_s = _LazyClient()
+s = cast('httpx.Client', _s)
 
 VCS_SUFFIXES = ('-git', '-hg', '-svn', '-bzr')
 AUR_BLACKLIST = {
@@ -122,26 +198,38 @@ def edit_file(filename: str) -> Iterator[str]:
     for line in f:
       yield line.rstrip('\n')
 
+def obtain_variables(
+  arrays: Iterable[str] = (),
+  scalars: Iterable[str] = (),
+) -> Tuple[Dict[str, Optional[List[str]]], Dict[str, Optional[str]]]:
+  '''
+  Obtain any number of array and scalar variables from PKGBUILD.
+
+  Works by calling bash to source PKGBUILD in the sandbox once. Results
+  are cached until PKGBUILD changes. Unset or empty arrays and unset
+  scalars are None.
+  '''
+  arrays = list(arrays)
+  scalars = list(scalars)
+  r = evaluate_pkgbuild(arrays, scalars)
+  if r.error is not None:
+    raise r.error
+  return (
+    {name: r.arrays[name] for name in arrays},
+    {name: r.scalars[name] for name in scalars},
+  )
+
+def obtain_arrays(*names: str) -> Dict[str, Optional[List[str]]]:
+  '''
+  Obtain array variables from PKGBUILD, by name.
+  '''
+  return obtain_variables(arrays=names)[0]
+
 def obtain_array(name: str) -> Optional[List[str]]:
   '''
   Obtain an array variable from PKGBUILD.
-
-  Works by calling bash to source PKGBUILD, writing the array to a temporary file, and reading from the file.
   '''
-  with tempfile.NamedTemporaryFile(dir='/tmp') as output_file:
-    command_write_array_out = """printf "%s\\0" "${{{}[@]}}" > {}""" \
-        .format(name, output_file.name)
-    extra_binds = ['--bind', output_file.name, output_file.name, '--ro-bind', 'PKGBUILD', '/tmp/PKGBUILD', '--chdir', '/tmp']
-    command_export_array = UNTRUSTED_PREFIX + extra_binds + [ # type: ignore
-      '/bin/bash', '-c', "source PKGBUILD && {}".format(command_write_array_out)
-    ]
-    subprocess.run(command_export_array, stderr=subprocess.PIPE,
-                   check=True)
-    res = output_file.read().decode()
-    if res == '\0':
-      return None
-    variable = res.split('\0')[:-1]
-    return variable
+  return obtain_arrays(name)[name]
 
 def obtain_depends() -> Optional[List[str]]:
   return obtain_array('depends')
@@ -199,21 +287,14 @@ def run_cmd(cmd: Cmd, **kwargs) -> str:
 
 def get_pkgver_and_pkgrel() -> Tuple[Optional[str], Optional[PkgRel]]:
   pkgrel: Optional[PkgRel] = None
-  pkgver = None
-  cmd = 'source PKGBUILD && declare -p pkgver pkgrel || :'
-  output = run_protected(['/bin/bash', '-c', cmd], silent = True)
-  pattern = re.compile('declare -- pkg(ver|rel)="([^"]+)"')
-  for line in output.splitlines():
-    m = pattern.fullmatch(line)
-    if m:
-      value = m.group(2)
-      if m.group(1) == "rel":
-        try:
-          pkgrel = int(value)
-        except (ValueError, TypeError):
-          pkgrel = value
-      else:
-        pkgver = value
+  r = evaluate_pkgbuild()
+  # empty values are treated as unset, like before
+  pkgver = r.scalars.get('pkgver') or None
+  if value := r.scalars.get('pkgrel'):
+    try:
+      pkgrel = int(value)
+    except ValueError:
+      pkgrel = value
 
   return pkgver, pkgrel
 
@@ -326,7 +407,7 @@ def git_add_files(
 def git_commit(*, check_status: bool = True) -> None:
   if check_status:
     ret = [x for x in
-           _run_cmd(["git", "status", "-s", "."]).splitlines()
+           _run_cmd(["git", "status", "-s", "."], keep_all=True).splitlines()
            if x.split(None, 1)[0] != '??']
     if not ret:
       return
@@ -392,11 +473,11 @@ def _update_aur_repo_real(pkgbase: str) -> None:
   aurpath = _ensure_aur_repo(pkgbase)
 
   with at_dir(aurpath):
-    oldfiles = set(_run_cmd(['git', 'ls-files']).splitlines())
+    oldfiles = set(_run_cmd(['git', 'ls-files'], keep_all=True).splitlines())
 
   newfiles = set()
   logger.info('copying files to AUR repo: %s', aurpath)
-  files = _run_cmd(['git', 'ls-files']).splitlines()
+  files = _run_cmd(['git', 'ls-files'], keep_all=True).splitlines()
   for f in files:
     if f in SPECIAL_FILES:
       continue
@@ -414,7 +495,7 @@ def _update_aur_repo_real(pkgbase: str) -> None:
       except OSError as e:
         logger.warning('failed to remove file %s: %s', f, e)
 
-    if not _allow_update_aur_repo(pkgbase, _run_cmd(['git', 'diff'])):
+    if not _allow_update_aur_repo(pkgbase, _run_cmd(['git', 'diff'], keep_all=True)):
       return
 
     with open('.SRCINFO', 'wb') as srcinfo:
@@ -471,7 +552,7 @@ def single_main(build_prefix: str = 'makepkg') -> None:
 
 def clean_directory() -> List[str]:
   '''clean all PKGBUILD and related files'''
-  files = _run_cmd(['git', 'ls-files']).splitlines()
+  files = _run_cmd(['git', 'ls-files'], keep_all=True).splitlines()
   logger.info('clean directory')
   ret = []
   for f in files:
@@ -588,7 +669,7 @@ def aur_post_build() -> None:
   git_rm_files(_g.aur_pre_files)
   existing_files = [x for x in _g.aur_building_files if os.path.exists(x)]
   git_add_files(existing_files, force=True)
-  output = _run_cmd(["git", "status", "-s", "."]).strip()
+  output = _run_cmd(["git", "status", "-s", "."], keep_all=True).strip()
   if output:
     git_commit()
   del _g.aur_pre_files, _g.aur_building_files
@@ -634,7 +715,7 @@ def check_library_provides() -> None:
   provides_pattern = re.compile(r'^provides = .*\.so$')
   pkgs = [n for n in os.listdir() if pkg_pattern.search(n)]
   for pkg in pkgs:
-    pkginfo = _run_cmd(['tar', 'xOf', pkg, '--force-local', '.PKGINFO'])
+    pkginfo = _run_cmd(['tar', 'xOf', pkg, '--force-local', '.PKGINFO'], keep_all=True)
     for line in pkginfo.splitlines():
       if provides_pattern.match(line):
         raise Exception(f'{pkg} has an unversioned library "provides" entry: {line[11:]}')
@@ -11,11 +11,12 @@ from pathlib import Path
 import time
 import json
 import signal
+import hashlib
 from contextlib import suppress
 
 from .typing import LilacInfo, Cmd, RUsage, PkgToBuild, OnBuildVers, Report
 from .nvchecker import NvResults
-from .packages import Dependency, get_built_package_files
+from .packages import Dependency, get_built_package_files, built_packages
 from .tools import reap_zombies
 from .nomypy import BuildResult # type: ignore
 from . import systemd
@@ -91,6 +92,7 @@ def build_package(
       if error:
         raise error
     finally:
+      built_packages.invalidate(pkgdir)
       if to_build.workerman.name == 'local':
         may_need_cleanup()
       reap_zombies()
@@ -134,6 +136,29 @@ def build_package(
     )
   return result, pkg_version
 
+def resolve_dep_files(depends: Iterable[Dependency]) -> Optional[list[str]]:
+  '''"pkgdir/filename" of built dependencies; None if any is missing'''
+  ret = []
+  for d in depends:
+    if (p := d.resolve()) is None:
+      return None
+    ret.append(f'{d.pkgdir.name}/{p.name}')
+  return ret
+
+def build_fingerprint(
+  tree: str, dep_files: Iterable[str], on_build_vers: OnBuildVers,
+) -> str:
+  '''fingerprint of the inputs of a build
+
+  tree is the git tree of the pkgdir, which also covers the build_prefix set
+  in lilac.py. Only the new versions of on_build_vers are used.
+  '''
+  h = hashlib.sha1(tree.encode())
+  for f in sorted(dep_files):
+    h.update(b'\0' + f.encode())
+  h.update(b'\0' + json.dumps([new for _, new in on_build_vers]).encode())
+  return h.hexdigest()
+
 def resolve_depends(repo: Optional[Repo], depends: Iterable[Dependency]) -> list[str]:
   need_build_first = set()
   depend_packages = []
@@ -0,0 +1,149 @@
+'''progress of the running batch, so that an interrupted batch can be resumed
+
+The state is written to a JSON file each time a build starts or finishes and
+removed when the batch completes. A batch started with the same packages
+while the file exists continues the interrupted one: it diffs from the same
+commit and skips packages that have been built or have failed, as long as
+nvchecker reports the same versions for them.
+'''
+
+from __future__ import annotations
+
+import os
+import json
+import threading
+import logging
+from pathlib import Path
+from typing import Any, Optional
+
+from .vendor.myutils import safe_overwrite
+from .nvchecker import NvResults
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+
+class BatchCheckpoint:
+  def __init__(self, path: Path) -> None:
+    self.path = path
+    self.pkgs: list[str] = []
+    self.last_commit: Optional[str] = None
+    # pkgbase -> newvers it has been built for
+    self.built: dict[str, list[Optional[str]]] = {}
+    # pkgbase -> (missing dependencies, newvers)
+    self.failed: dict[str, tuple[tuple[str, ...], list[Optional[str]]]] = {}
+    self.building: set[str] = set()
+    self.nvtaken: set[str] = set()
+    # builds that were running when the last batch was interrupted
+    self.interrupted: set[str] = set()
+    self.skipped: set[str] = set()
+    self._lock = threading.Lock()
+
+  def start(self, pkgs: list[str], last_commit: str) -> str:
+    '''start a batch, or resume the interrupted one for the same packages
+
+    Return the commit to look for changed packages from.
+    '''
+    self._reset()
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except FileNotFoundError:
+      data = None
+    except (OSError, ValueError):
+      logger.exception('failed to load checkpoint %s, ignoring', self.path)
+      data = None
+
+    if data is not None:
+      if data.get('version') != VERSION:
+        logger.warning('checkpoint version mismatch, ignoring')
+      elif data['pkgs'] != pkgs:
+        logger.warning(
+          'discarding the checkpoint of an interrupted batch for %r',
+          data['pkgs'] or 'all packages')
+      else:
+        last_commit = data['last_commit']
+        self.built = data['built']
+        self.failed = {
+          k: (tuple(missing), vers)
+          for k, (missing, vers) in data['failed'].items()
+        }
+        self.nvtaken = set(data['nvtaken'])
+        self.interrupted = set(data['building'])
+        logger.info(
+          'resuming interrupted batch: %d built, %d failed, %d were building',
+          len(self.built), len(self.failed), len(self.interrupted),
+        )
+
+    self.pkgs = pkgs
+    self.last_commit = last_commit
+    with self._lock:
+      self._save()
+    return last_commit
+
+  def _reset(self) -> None:
+    self.built = {}
+    self.failed = {}
+    self.building = set()
+    self.nvtaken = set()
+    self.interrupted = set()
+    self.skipped = set()
+
+  def skip_done(self, pkg: str, vers: Optional[NvResults]) -> bool:
+    '''whether pkg has been built or has failed for the same versions
+    before the batch was interrupted; such packages are added to `skipped`'''
+    newvers = [x.newver for x in vers] if vers is not None else []
+    if (old := self.built.get(pkg)) is not None:
+      done = old == newvers
+    elif (f := self.failed.get(pkg)) is not None:
+      done = f[1] == newvers
+    else:
+      done = False
+    if done:
+      self.skipped.add(pkg)
+    return done
+
+  def build_started(self, pkg: str) -> None:
+    with self._lock:
+      self.building.add(pkg)
+      self._save()
+
+  def build_finished(
+    self, pkg: str, vers: Optional[NvResults],
+    successful: bool, missing: tuple[str, ...] = (),
+  ) -> None:
+    newvers = [x.newver for x in vers] if vers is not None else []
+    with self._lock:
+      self.building.discard(pkg)
+      if successful:
+        self.built[pkg] = newvers
+        self.failed.pop(pkg, None)
+      else:
+        self.failed[pkg] = missing, newvers
+        self.built.pop(pkg, None)
+      self._save()
+
+  def nvtake_done(self, pkgs: set[str]) -> None:
+    with self._lock:
+      self.nvtaken.update(pkgs)
+      self._save()
+
+  def clear(self) -> None:
+    '''the batch has completed'''
+    self._reset()
+    try:
+      os.unlink(self.path)
+    except FileNotFoundError:
+      pass
+
+  def _save(self) -> None:
+    data: dict[str, Any] = {
+      'version': VERSION,
+      'pkgs': self.pkgs,
+      'last_commit': self.last_commit,
+      'built': self.built,
+      'failed': {k: [list(m), v] for k, (m, v) in self.failed.items()},
+      'building': sorted(self.building),
+      'nvtaken': sorted(self.nvtaken),
+    }
+    safe_overwrite(str(self.path), json.dumps(data))
@@ -1,14 +1,15 @@
 from __future__ import annotations
 
 import os
+import errno
+import codecs
+import collections
 import logging
 import subprocess
-import signal
 import sys
 import re
 from subprocess import CalledProcessError
 from typing import Optional, Dict
-import types
 from pathlib import Path
 from contextlib import suppress
 
@@ -69,6 +70,19 @@ def git_push() -> None:
 def git_reset_hard() -> None:
   run_cmd(['git', 'reset', '--hard'])
 
+def get_pkgdir_trees(rev: str = 'HEAD') -> Dict[str, str]:
+  '''object ids of the top-level trees (pkgdirs) at rev'''
+  out = subprocess.check_output(['git', 'ls-tree', '-z', rev], text=True)
+  ret = {}
+  for entry in out.split('\0'):
+    if not entry:
+      continue
+    info, name = entry.split('\t', 1)
+    _mode, type, oid = info.split()
+    if type == 'tree':
+      ret[name] = oid
+  return ret
+
 def get_git_branch() -> str:
   out = subprocess.check_output(
     ['git', 'branch', '--no-color'], universal_newlines = True)
@@ -78,13 +92,111 @@ def get_git_branch() -> str:
 
   return '(unknown branch)'
 
+class OutputCapture:
+  '''decode command output as it comes
+
+  Output is decoded as UTF-8, and text overwritten with "\r" is dropped
+  line by line. Only `head` plus `tail` characters are kept unless keep_all
+  is set, in which case they only limit the value returned by
+  getvalue(bounded=True).
+  '''
+  # unfinished lines longer than this are taken as they are
+  MAX_PENDING = 64 * 1024
+
+  def __init__(
+    self, head: int = 4 * 1024 ** 2, tail: int = 4 * 1024 ** 2,
+    keep_all: bool = False,
+  ) -> None:
+    self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    self._pending = ''
+    self._all: Optional[list[str]] = [] if keep_all else None
+    self._head_max = head
+    self._head: list[str] = []
+    self._head_room = head
+    self._tail: collections.deque[str] = collections.deque()
+    self._tail_size = 0
+    self._tail_max = tail
+    self.omitted = 0
+
+  def feed(self, data: bytes, final: bool = False) -> None:
+    text = self._pending + self._decoder.decode(data, final)
+    if final:
+      lines, self._pending = text, ''
+    else:
+      lines, nl, rest = text.rpartition('\n')
+      lines += nl
+      # drop what has been overwritten so far, but keep a trailing '\r'
+      # which may turn out to be part of '\r\n'
+      body = rest.rstrip('\r')
+      if '\r' in body:
+        rest = body.rsplit('\r', 1)[1] + rest[len(body):]
+      if len(rest) > self.MAX_PENDING:
+        lines, rest = lines + rest, ''
+      self._pending = rest
+    if lines:
+      lines = lines.replace('\r\n', '\n')
+      self._keep(re.sub(r'.*\r', '', lines))
+
+  def _keep(self, text: str) -> None:
+    if self._all is not None:
+      self._all.append(text)
+      return
+
+    if self._head_room > 0:
+      part = text[:self._head_room]
+      self._head.append(part)
+      self._head_room -= len(part)
+      text = text[len(part):]
+    if not text:
+      return
+
+    self._tail.append(text)
+    self._tail_size += len(text)
+    while self._tail_size > self._tail_max:
+      over = self._tail_size - self._tail_max
+      first = self._tail[0]
+      if len(first) <= over:
+        self._tail.popleft()
+        self._tail_size -= len(first)
+        self.omitted += len(first)
+      else:
+        self._tail[0] = first[over:]
+        self._tail_size -= over
+        self.omitted += over
+
+  def getvalue(self, bounded: bool = True) -> str:
+    if self._all is not None:
+      text = ''.join(self._all)
+      omitted = len(text) - self._head_max - self._tail_max
+      if not bounded or omitted <= 0:
+        return text
+      head = text[:self._head_max]
+      tail = text[len(text) - self._tail_max:]
+    else:
+      head = ''.join(self._head)
+      tail = ''.join(self._tail)
+      omitted = self.omitted
+      if not omitted:
+        return head + tail
+
+    l10n = intl.get_l10n('mail')
+    msg = l10n.format_value('output-omitted', {'count': omitted})
+    return f'{head}\n\n[{msg}]\n\n{tail}'
+
 def run_cmd(
   cmd: Cmd, *,
   use_pty: bool = False,
   silent: bool = False,
   cwd: Optional[os.PathLike] = None,
   env: Optional[Dict[str, str]] = None,
+  keep_all: bool = False,
 ) -> str:
+  '''run cmd and return its output
+
+  Only the first and last 4 Mi characters of the output are kept. Callers
+  that parse the output should set keep_all to get all of it on success;
+  the output in CalledProcessError is cut in either case.
+  '''
   logger.debug('running %r, %susing pty,%s showing output', cmd,
                '' if use_pty else 'not ',
                ' not' if silent else '')
@@ -98,12 +210,6 @@ def run_cmd(
     stdout = subprocess.PIPE
 
   try:
-    exited = False
-    def child_exited(signum: int, sigframe: Optional[types.FrameType]) -> None:
-      nonlocal exited
-      exited = True
-    old_hdl = signal.signal(signal.SIGCHLD, child_exited)
-
     p = subprocess.Popen(
       cmd, stdin = stdin,
       stdout = stdout, stderr = subprocess.STDOUT,
@@ -114,40 +220,30 @@ def run_cmd(
     else:
       assert p.stdout
       rfd = p.stdout.fileno()
-    out = []
-    outlen = 0
 
+    capture = OutputCapture(keep_all=keep_all)
+    outlen = 0
     while True:
+      # blocks until there is output; empty at EOF
       try:
-        r = os.read(rfd, 4096)
-        if not r:
-          if exited:
-            break
-          else:
-            continue
-      except InterruptedError:
-        continue
+        r = os.read(rfd, 256 * 1024)
       except OSError as e:
-        if e.errno == 5: # Input/output error: no clients run
+        if e.errno == errno.EIO: # no clients of the pty left
           break
-        else:
-          raise
+        raise
+      if not r:
+        break
       r = r.replace(b'\x0f', b'') # ^O
       if not silent:
         sys.stderr.buffer.write(r)
-      out.append(r)
-      outlen += len(r)
-      if outlen > 1024 ** 3: # larger than 1G
+      capture.feed(r)
+      if outlen <= 1024 ** 3 < outlen + len(r): # larger than 1G
         p.kill()
+      outlen += len(r)
+    capture.feed(b'', final=True)
 
     code = p.wait()
-    if old_hdl is not None:
-      signal.signal(signal.SIGCHLD, old_hdl)
-
-    outb = b''.join(out)
-    outs = outb.decode('utf-8', errors='replace')
-    outs = outs.replace('\r\n', '\n')
-    outs = re.sub(r'.*\r', '', outs)
+    outs = capture.getvalue(bounded=code != 0)
     if outlen > 1024 ** 3: # larger than 1G
       l10n = intl.get_l10n('mail')
       outs += '\n\n' + l10n.format_value('too-much-output') + '\n'
@@ -159,11 +255,6 @@ def run_cmd(
     if use_pty:
       os.close(rfd)
 
-def pkgrel_changed(from_: str, to: str, pkgname: str) -> bool:
-  cmd = ["git", "diff", "-p", from_, to, '--', pkgname + '/PKGBUILD']
-  r = run_cmd(cmd, silent=True).splitlines()
-  return any(x.startswith('+pkgrel=') for x in r)
-
 UNTRUSTED_PREFIX: Cmd = [
   'bwrap', '--unshare-all', '--ro-bind', '/', '/', '--tmpfs', '/home',
   '--tmpfs', '/run', '--die-with-parent',
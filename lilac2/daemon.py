@@ -0,0 +1,135 @@
+'''accept build requests over a local socket for `lilac --daemon`
+
+A request is one line of package arguments, the same as on the lilac
+command line. An empty line requests a full batch (nvchecker for all
+packages), e.g. from a git hook after a push.
+
+Submitted packages join the running batch if it hasn't passed them yet
+(i.e. they are still waiting for nvchecker or their dependencies), and are
+built from the tree that batch has pulled. The others, full batch requests
+and requests with --force are merged and start the next batch as soon as
+the running one ends. Worker managers, and the dependency maps while the
+repository is unchanged, are kept between batches. Each batch still pulls
+git, loads lilac.yaml files (from their cache) and runs nvchecker for its
+packages.
+'''
+
+from __future__ import annotations
+
+import os
+import socket
+import socketserver
+import threading
+import logging
+from pathlib import Path
+from typing import Optional, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+class Requests:
+  '''pending requests, merged until the next batch picks them up'''
+  def __init__(self) -> None:
+    self._cond = threading.Condition()
+    self._pkgs: dict[str, None] = {}
+    self._full = False
+    self._listener: Optional[Callable[[], None]] = None
+
+  def set_listener(self, listener: Optional[Callable[[], None]]) -> None:
+    '''call listener when packages are submitted, e.g. to wake a running batch'''
+    with self._cond:
+      self._listener = listener
+
+  def submit(self, pkgs: list[str]) -> None:
+    with self._cond:
+      if pkgs:
+        self._pkgs.update(dict.fromkeys(pkgs))
+      else:
+        self._full = True
+      self._cond.notify_all()
+      if pkgs and self._listener is not None:
+        self._listener()
+
+  def request_full(self) -> None:
+    self.submit([])
+
+  def wait(self, timeout: Optional[float] = None) -> Optional[list[str]]:
+    '''wait for a request
+
+    Return the packages to build, [] for a full batch, or None on timeout.
+    A full batch is returned first; packages stay queued for the next call.
+    '''
+    with self._cond:
+      self._cond.wait_for(lambda: self._full or self._pkgs, timeout)
+      if self._full:
+        self._full = False
+        return []
+      elif self._pkgs:
+        pkgs = list(self._pkgs)
+        self._pkgs.clear()
+        return pkgs
+      else:
+        return None
+
+  def take(self, accept: Callable[[list[str]], Iterable[str]]) -> list[str]:
+    '''take the queued packages accept() picks from those given to it
+
+    The rest stay queued for the next batch.
+    '''
+    with self._cond:
+      if not self._pkgs:
+        return []
+      taken = list(accept(list(self._pkgs)))
+      for p in taken:
+        del self._pkgs[p]
+      return taken
+
+class _Handler(socketserver.StreamRequestHandler):
+  server: _Server
+
+  def handle(self) -> None:
+    line = self.rfile.readline(65536).decode('utf-8', errors='replace')
+    pkgs = line.split()
+    logger.info('received request: %r', pkgs)
+    self.server.requests.submit(pkgs)
+    if pkgs:
+      self.wfile.write(f'queued {len(pkgs)} package(s)\n'.encode())
+    else:
+      self.wfile.write(b'queued a full batch\n')
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, path: Path, requests: Requests) -> None:
+    self.requests = requests
+    super().__init__(str(path), _Handler)
+
+def start_server(path: Path, requests: Requests) -> socketserver.BaseServer:
+  '''listen on the unix socket at path in a background thread'''
+  try:
+    path.unlink()
+  except FileNotFoundError:
+    pass
+  old_umask = os.umask(0o177)
+  try:
+    server = _Server(path, requests)
+  finally:
+    os.umask(old_umask)
+  t = threading.Thread(
+    target = server.serve_forever,
+    name = 'request-server',
+    daemon = True,
+  )
+  t.start()
+  logger.info('listening on %s', path)
+  return server
+
+def submit(path: Path, pkgs: list[str]) -> str:
+  '''send a request to a running daemon and return its reply'''
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+    sock.connect(str(path))
+    sock.sendall((' '.join(pkgs) + '\n').encode())
+    sock.shutdown(socket.SHUT_WR)
+    reply = b''
+    while data := sock.recv(4096):
+      reply += data
+  return reply.decode()
@@ -0,0 +1,267 @@
+'''fork workers from a process that has lilac2.worker imported and the
+package data loaded, instead of starting a new interpreter for each build
+
+`python -m lilac2.forkserver serve SOCKET REPONAME` runs the server. It stops when
+its stdin is closed.
+
+The command run for a build is this file run as a script with
+`connect SOCKET PKGBASE`. It only imports the standard library and starts
+quickly even with -S. It passes its stdio, working directory and
+environment to the server. The server forks a supervisor that moves into the
+client's cgroup, so a build stays in its systemd unit, and forks the worker
+in its own process group. The client forwards signals to the worker. When
+the worker exits, the supervisor sends its wait status and resource usage
+back and the client exits with that status. If the client goes away (e.g.
+killed on timeout), the supervisor kills the worker's process group. If the
+server can't be reached or the supervisor can't join the cgroup, the client
+runs lilac2.worker itself.
+'''
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import signal
+import socket
+import select
+import importlib
+import traceback
+from contextlib import suppress
+from typing import Any
+
+def worker_cmd(pkgbase: str) -> list[str]:
+  return [
+    sys.executable,
+    '-Xno_debug_ranges', # save space
+    '-P', # don't prepend cwd to sys.path where unexpected directories may exist
+    '-m', 'lilac2.worker', pkgbase,
+  ]
+
+def client_cmd(path: str, pkgbase: str) -> list[str]:
+  return [
+    sys.executable, '-S', '-P', '-Xno_debug_ranges',
+    os.path.abspath(__file__), 'connect', path, pkgbase,
+  ]
+
+def _get_cgroup(pid: int | str) -> str:
+  with open(f'/proc/{pid}/cgroup') as f:
+    for l in f:
+      if l.startswith('0::'):
+        return l[3:].rstrip('\n')
+  raise LookupError('no cgroup v2 found')
+
+def run_client(path: str, pkgbase: str) -> None:
+  header = json.dumps({
+    'pid': os.getpid(),
+    'cwd': os.getcwd(),
+    'env': dict(os.environ),
+    'pkgbase': pkgbase,
+  }).encode() + b'\n'
+
+  pid = None
+  # kept open until the worker exits; closing it kills the worker
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  f = sock.makefile('rb')
+  try:
+    sock.connect(path)
+    socket.send_fds(sock, [header], [0, 1, 2])
+    reply = f.readline()
+    if reply.startswith(b'pid '):
+      pid = int(reply[4:])
+    else:
+      print(f'[forkserver] {reply.decode().strip()}', file=sys.stderr, flush=True)
+  except OSError as e:
+    print(f'[forkserver] {e!r}', file=sys.stderr, flush=True)
+
+  if pid is None:
+    print('[forkserver] running the worker directly', file=sys.stderr, flush=True)
+    f.close()
+    sock.close()
+    cmd = worker_cmd(pkgbase)
+    os.execv(cmd[0], cmd)
+
+  def forward(sig: int, frame: object) -> None:
+    try:
+      os.kill(pid, sig)
+    except ProcessLookupError:
+      pass
+
+  for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]:
+    signal.signal(sig, forward)
+
+  reply = f.readline()
+  if not reply:
+    print('[forkserver] lost the connection to the server', file=sys.stderr, flush=True)
+    sys.exit(1)
+  result = json.loads(reply)
+  utime, stime, maxrss = result['rusage']
+  print(
+    f'[forkserver] worker exited: status {result["status"]}, '
+    f'user {utime:.2f}s, system {stime:.2f}s, maxrss {maxrss} KiB',
+    file=sys.stderr, flush=True,
+  )
+
+  code = os.waitstatus_to_exitcode(result['status'])
+  if code < 0:
+    # killed by a signal; die the same way
+    signal.signal(-code, signal.SIG_DFL)
+    os.kill(os.getpid(), -code)
+  sys.exit(code)
+
+def _supervise(conn: socket.socket, fds: list[int], header: dict[str, Any]) -> None:
+  '''in the forked child: run the worker and report its exit to the client'''
+  # we wait for the worker ourselves
+  signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+  try:
+    client_cgroup = _get_cgroup(header['pid'])
+    if client_cgroup != _get_cgroup('self'):
+      with open(f'/sys/fs/cgroup{client_cgroup}/cgroup.procs', 'w') as f:
+        f.write(str(os.getpid()))
+  except (OSError, LookupError) as e:
+    conn.sendall(f'failed to join the cgroup of the client: {e!r}\n'.encode())
+    return
+
+  pid = os.fork()
+  if pid == 0:
+    code = 0
+    try:
+      os.setpgid(0, 0)
+      conn.close()
+      _run_worker(fds, header)
+    except SystemExit as e:
+      code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+      traceback.print_exc()
+      code = 1
+    finally:
+      sys.stdout.flush()
+      sys.stderr.flush()
+      os._exit(code)
+
+  # both sides set it so that killpg works whichever runs first
+  with suppress(OSError):
+    os.setpgid(pid, pid)
+  for fd in fds:
+    os.close(fd)
+  pidfd = os.pidfd_open(pid)
+  conn.sendall(f'pid {pid}\n'.encode())
+
+  while True:
+    r, _, _ = select.select([conn, pidfd], [], [])
+    if pidfd in r:
+      break
+    # the client sends nothing after the header
+    if not conn.recv(4096):
+      # the client has gone away, e.g. killed on timeout
+      with suppress(ProcessLookupError):
+        os.killpg(pid, signal.SIGKILL)
+      break
+
+  _, status, ru = os.wait4(pid, 0)
+  os.close(pidfd)
+  result = {
+    'status': status,
+    'rusage': [ru.ru_utime, ru.ru_stime, ru.ru_maxrss],
+  }
+  with suppress(OSError):
+    conn.sendall(json.dumps(result).encode() + b'\n')
+
+def _run_worker(fds: list[int], header: dict[str, Any]) -> None:
+  '''in the worker process'''
+  for i, fd in enumerate(fds):
+    os.dup2(fd, i)
+    os.close(fd)
+  os.chdir(header['cwd'])
+  os.environ.clear()
+  os.environ.update(header['env'])
+  sys.argv = ['lilac2.worker', header['pkgbase']]
+
+  worker = importlib.import_module('.worker', __package__)
+  worker.main(data_loaded=True)
+
+def serve(path: str, reponame: str) -> None:
+  # what every worker needs, done once before forking
+  importlib.import_module('.worker', __package__)
+  from .const import _G, PACMAN_DB_DIR
+  from .pkgbuild import load_data
+
+  _G.reponame = reponame
+  load_data(PACMAN_DB_DIR)
+
+  # supervisors report to their clients and are not waited for
+  signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  with suppress(FileNotFoundError):
+    os.unlink(path)
+  old_umask = os.umask(0o177)
+  try:
+    server.bind(path)
+  finally:
+    os.umask(old_umask)
+  server.listen()
+  print('ready', flush=True)
+
+  try:
+    _serve(server)
+  finally:
+    server.close()
+    with suppress(FileNotFoundError):
+      os.unlink(path)
+
+def _serve(server: socket.socket) -> None:
+  while True:
+    stdin = sys.stdin.fileno()
+    r, _, _ = select.select([server.fileno(), stdin], [], [])
+    if stdin in r and not os.read(stdin, 4096):
+      # our parent has gone away
+      break
+    if server.fileno() not in r:
+      continue
+
+    conn, _ = server.accept()
+    fds: list[int] = []
+    try:
+      msg, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+      # headers are small but may come in parts
+      while not msg.endswith(b'\n'):
+        more = conn.recv(65536)
+        if not more:
+          raise EOFError
+        msg += more
+      header = json.loads(msg)
+    except Exception:
+      traceback.print_exc()
+      for fd in fds:
+        os.close(fd)
+      conn.close()
+      continue
+
+    if os.fork() == 0:
+      code = 0
+      try:
+        server.close()
+        _supervise(conn, fds, header)
+      except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+      except BaseException:
+        traceback.print_exc()
+        code = 1
+      finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+    for fd in fds:
+      os.close(fd)
+    conn.close()
+
+if __name__ == '__main__':
+  if sys.argv[1] == 'connect':
+    run_client(sys.argv[2], sys.argv[3])
+  elif sys.argv[1] == 'serve':
+    serve(sys.argv[2], sys.argv[3])
+  else:
+    sys.exit(f'unknown command: {sys.argv[1]}')
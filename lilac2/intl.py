@@ -1,12 +1,12 @@
 import os
 import locale
 
-from fluent.runtime import FluentLocalization, FluentResourceLoader
-
 cache: dict[str, str] = {}
 
 def get_l10n(name):
   if name not in cache:
+    # fluent takes a while to import and most builds send no mail
+    from fluent.runtime import FluentLocalization, FluentResourceLoader
     d = os.path.dirname(__file__)
     loc = locale.getlocale()[0]
     loader = FluentResourceLoader(f'{d}/l10n/{{locale}}')
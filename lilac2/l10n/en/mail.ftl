@@ -25,8 +25,12 @@ package-staged-subject = { $pkg } { $version } has been packaged just now
 package-staged-body = The package has been placed in the staging directory, please check it and then publish manually.
 
 too-much-output = Too much output, killed.
+output-omitted = { $count } characters of output omitted
 
 log-too-long = Log too long, omitting...
+log-first-error = The first error in the omitted part:
+digest-subject = { $count } reports from this batch
+digest-report-attached = This report is too large and is attached.
 
 nvchecker-error-report = nvchecker error report
 
@@ -53,6 +57,7 @@ packaging-error-unknown = An unknown error happened! Traceback:
 packaging-log = Packaging log:
 
 lilac-yaml-loadding-error = Failed to load lilac.yaml for %s
+lilac-py-loading-error = Failed to load lilac.py for %s
 
 package-in-official-group = Packages is added to official groups: { $groups }
 package-replacing-official-package = Package is replacing official packages: { $packages }
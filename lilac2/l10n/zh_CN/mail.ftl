@@ -13,8 +13,12 @@ package-staged-subject = { $pkg } { $version } 刚刚打包了
 package-staged-body = 软件包已被置于 staging 目录，请查验后手动发布。
 
 too-much-output = 输出过多，已击杀。
+output-omitted = 省略了 { $count } 个字符的输出
 
 log-too-long = 日志过长，省略ing……
+log-first-error = 省略部分中的第一处错误：
+digest-subject = 本次运行的 { $count } 份报告
+digest-report-attached = 此报告过大，已作为附件发送。
 
 nvchecker-error-report = nvchecker 错误报告
 
@@ -42,6 +46,7 @@ packaging-error-unknown = 发生未知错误！{ -traceback-follows }
 packaging-log = 打包日志：
 
 lilac-yaml-loadding-error = 为软件包 %s 载入 lilac.yaml 时失败
+lilac-py-loading-error = 为软件包 %s 载入 lilac.py 时失败
 
 package-in-official-group = 软件包被加入了官方组：{ $groups }
 package-replacing-official-package = 软件包将取代官方包：{ $packages }
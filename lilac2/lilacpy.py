@@ -4,12 +4,35 @@ import sys
 import contextlib
 import importlib.util
 from pathlib import Path
-from typing import Generator, cast
+from typing import Generator, Any, cast
 
 from .typing import LilacMod
 from . import lilacyaml
 from . import api
 
+def _script_code(name: str, script: str) -> str:
+  if name == 'post_build_always':
+    code = [f'def {name}(success):']
+  else:
+    code = [f'def {name}():']
+  for line in script.splitlines():
+    code.append(f'  {line}')
+  return '\n'.join(code)
+
+def check_lilac(dir: Path, yamlconf: dict[str, Any]) -> None:
+  '''compile lilac.py and *_script snippets in lilac.yaml without running them
+
+  SyntaxError is raised for bad code.
+  '''
+  for k, v in yamlconf.items():
+    if k.endswith('_script'):
+      code_str = _script_code(k[:-len('_script')], v)
+      compile(code_str, str(dir / 'lilac.yaml'), 'exec')
+
+  path = dir / 'lilac.py'
+  with contextlib.suppress(FileNotFoundError):
+    compile(path.read_bytes(), str(path), 'exec')
+
 @contextlib.contextmanager
 def load_lilac(dir: Path) -> Generator[LilacMod, None, None]:
   try:
@@ -23,19 +46,12 @@ def load_lilac(dir: Path) -> Generator[LilacMod, None, None]:
     g = None
     for k, v in yamlconf.items():
       if k.endswith('_script'):
-        name = k[:-len('_script')]
-        if name == 'post_build_always':
-          code = [f'def {name}(success):']
-        else:
-          code = [f'def {name}():']
-        for line in v.splitlines():
-          code.append(f'  {line}')
         if g is None:
           g = vars(mod)
           # "import" lilac2.api
           g.update({a: b for a, b in api.__dict__.items()
                     if not a.startswith('_')})
-        code_str = '\n'.join(code)
+        code_str = _script_code(k[:-len('_script')], v)
         # run code in `mod` namespace
         exec(code_str, g)
       else:
@@ -1,28 +1,42 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Any, Iterator, cast
+from typing import Any, Iterator, Optional, cast
 import importlib.resources
 import sys
 import datetime
+import subprocess
+import hashlib
+import pickle
+import logging
+import os
+import traceback
 
 import yaml
 
-from .vendor.myutils import dehumantime
+from .vendor.myutils import dehumantime, safe_overwrite
 
 from . import api
 from .const import _G, PACMAN_DB_DIR
 from .typing import LilacInfo, LilacInfos, ExcInfo, NvEntries, OnBuildEntry
 
+logger = logging.getLogger(__name__)
+
 ALIASES: dict[str, Any] = {}
+_ALIASES_HASH = ''
 FUNCTIONS: list[str] = [
   'pre_build', 'post_build', 'post_build_always',
 ]
+# bump this when LilacInfo or the parsing of lilac.yaml changes
+_CACHE_VERSION = 2
+# load in a process pool only when there are this many packages to load
+_PARALLEL_THRESHOLD = 50
 
 def _load_aliases() -> None:
-  global ALIASES
+  global ALIASES, _ALIASES_HASH
   data = importlib.resources.files('lilac2').joinpath('aliases.yaml').read_text()
   ALIASES = yaml.safe_load(data)
+  _ALIASES_HASH = hashlib.sha1(data.encode()).hexdigest()
 
 _load_aliases()
 
@@ -69,13 +83,52 @@ def load_lilac_yaml(dir: Path) -> dict[str, Any]:
 
 def load_managed_lilacinfos(
   repodir: Path, use_pacfiles: bool = False,
+  cache_file: Optional[Path] = None,
+  jobs: Optional[int] = None,
 ) -> tuple[LilacInfos, dict[str, ExcInfo]]:
+  '''load and check all managed packages' lilac.yaml and lilac.py
+
+  Packages are loaded in a pool of `jobs` processes (the number of CPUs by
+  default). lilac.py files and *_script snippets are compiled but not run.
+
+  If cache_file is given, parsed LilacInfo objects are kept there keyed by the
+  git blob hashes of lilac.yaml and lilac.py so that only changed packages
+  get loaded again.
+  '''
   infos: LilacInfos = {}
   errors = {}
 
-  for x in iter_pkgdir(repodir):
+  if cache_file is not None:
+    fingerprint = _cache_fingerprint(use_pacfiles)
+    cached = _load_cache(cache_file, fingerprint)
+    blobs = _pkgdir_blobs(repodir)
+  else:
+    cached = {}
+    blobs = {}
+  new_cache: dict[str, tuple[str, LilacInfo]] = {}
+
+  pkgdirs = list(iter_pkgdir(repodir))
+  loaded: dict[str, LilacInfo] = {}
+  todo = []
+  for x in pkgdirs:
+    blob = blobs.get(x.name)
+    if blob and (c := cached.get(x.name)) and c[0] == blob:
+      loaded[x.name] = c[1]
+    else:
+      todo.append(x)
+
+  for name, r in _load_and_check_all(todo, use_pacfiles, jobs):
+    if isinstance(r, LilacInfo):
+      loaded[name] = r
+    else:
+      errors[name] = r
+
+  for x in pkgdirs:
+    if (info := loaded.get(x.name)) is None:
+      continue
+    if blob := blobs.get(x.name):
+      new_cache[x.name] = blob, info
     try:
-      info = load_lilacinfo(x, use_pacfiles=use_pacfiles)
       if not info.managed:
         continue
       if info.time_limit_hours < 0:
@@ -84,10 +137,180 @@ def load_managed_lilacinfos(
     except Exception:
       errors[x.name] = cast(ExcInfo, sys.exc_info())
 
+  if cache_file is not None:
+    logger.debug('lilac.yaml cache: %d of %d entries reused',
+                 len(pkgdirs) - len(todo), len(pkgdirs))
+    _save_cache(cache_file, fingerprint, new_cache)
+
   return infos, errors
 
+def load_and_check_lilacinfo(
+  dir: Path, use_pacfiles: bool = False,
+) -> LilacInfo:
+  '''load_lilacinfo, and compile lilac.py and scripts for managed packages'''
+  from .lilacpy import check_lilac
+
+  yamlconf = load_lilac_yaml(dir)
+  info = lilacinfo_from_yaml(dir, yamlconf, use_pacfiles=use_pacfiles)
+  if info.managed:
+    check_lilac(dir, yamlconf)
+  return info
+
+class _RemoteTraceback(Exception):
+  def __init__(self, tb: str) -> None:
+    self.tb = tb
+
+  def __str__(self) -> str:
+    return self.tb
+
+def _init_pool_worker(reponame: Optional[str]) -> None:
+  if reponame is not None:
+    _G.reponame = reponame
+
+def _load_and_check_chunk(
+  dirs: list[Path], use_pacfiles: bool,
+) -> list[tuple[str, Optional[LilacInfo], Optional[Exception], str]]:
+  '''runs in pool processes; tracebacks are returned formatted'''
+  ret: list[tuple[str, Optional[LilacInfo], Optional[Exception], str]] = []
+  for dir in dirs:
+    try:
+      info = load_and_check_lilacinfo(dir, use_pacfiles=use_pacfiles)
+      ret.append((dir.name, info, None, ''))
+    except Exception as e:
+      tb = ''.join(traceback.format_exception(e))
+      try:
+        pickle.dumps(e)
+      except Exception:
+        e = RuntimeError(repr(e))
+      ret.append((dir.name, None, e, tb))
+  return ret
+
+def _load_and_check_all(
+  dirs: list[Path], use_pacfiles: bool, jobs: Optional[int],
+) -> Iterator[tuple[str, LilacInfo | ExcInfo]]:
+  if jobs is None:
+    jobs = os.process_cpu_count() or 1
+  if jobs <= 1 or len(dirs) < _PARALLEL_THRESHOLD:
+    for dir in dirs:
+      try:
+        yield dir.name, load_and_check_lilacinfo(dir, use_pacfiles=use_pacfiles)
+      except Exception:
+        yield dir.name, cast(ExcInfo, sys.exc_info())
+    return
+
+  import multiprocessing
+  from concurrent.futures import ProcessPoolExecutor
+
+  # lilac may have threads running (e.g. in daemon mode) which forking
+  # could leave with their locks held in the children
+  ctx = multiprocessing.get_context('forkserver')
+  ctx.set_forkserver_preload([__name__])
+
+  chunksize = -(-len(dirs) // (jobs * 4))
+  chunks = [dirs[i:i+chunksize] for i in range(0, len(dirs), chunksize)]
+  logger.info('loading %d packages with %d processes', len(dirs), jobs)
+  with ProcessPoolExecutor(
+    max_workers = jobs,
+    mp_context = ctx,
+    initializer = _init_pool_worker,
+    initargs = (getattr(_G, 'reponame', None),),
+  ) as executor:
+    for chunk in executor.map(
+      _load_and_check_chunk, chunks, [use_pacfiles] * len(chunks),
+    ):
+      for name, info, exc, tb in chunk:
+        if info is not None:
+          yield name, info
+        else:
+          assert exc is not None
+          exc.__cause__ = _RemoteTraceback(tb)
+          yield name, cast(ExcInfo, (type(exc), exc, None))
+
+def _cache_fingerprint(use_pacfiles: bool) -> str:
+  # things other than lilac.yaml that affect the result of load_lilacinfo
+  data = repr((
+    _CACHE_VERSION, _ALIASES_HASH, str(PACMAN_DB_DIR),
+    getattr(_G, 'reponame', None), use_pacfiles,
+  ))
+  return hashlib.sha1(data.encode()).hexdigest()
+
+def _pkgdir_blobs(repodir: Path) -> dict[str, str]:
+  '''pkgbase -> git blob hashes of its lilac.yaml and lilac.py
+
+  Packages with uncommitted changes to these files are left out so they are
+  always loaded.
+  '''
+  pathspecs = ['*/lilac.yaml', '*/lilac.py']
+  try:
+    out = subprocess.check_output(
+      ['git', 'ls-files', '-s', '-z', '--', *pathspecs],
+      cwd = repodir, text = True,
+    )
+    dirty = subprocess.check_output(
+      ['git', 'diff', '--name-only', '-z', '--relative', 'HEAD', '--', *pathspecs],
+      cwd = repodir, text = True,
+    ).split('\0')
+  except (subprocess.CalledProcessError, FileNotFoundError):
+    logger.warning('failed to get lilac.yaml hashes from git, cache disabled.')
+    return {}
+
+  yamls = {}
+  pys = {}
+  dirty_pkgs = {x.split('/', 1)[0] for x in dirty if x}
+  for entry in out.split('\0'):
+    if not entry:
+      continue
+    meta, path = entry.split('\t', 1)
+    pkgbase, file = path.split('/', 1)
+    if pkgbase in dirty_pkgs:
+      continue
+    if file == 'lilac.yaml':
+      yamls[pkgbase] = meta.split()[1]
+    elif file == 'lilac.py':
+      pys[pkgbase] = meta.split()[1]
+
+  return {
+    pkgbase: f'{blob}:{pys.get(pkgbase, '')}'
+    for pkgbase, blob in yamls.items()
+  }
+
+def _load_cache(
+  cache_file: Path, fingerprint: str,
+) -> dict[str, tuple[str, LilacInfo]]:
+  try:
+    with open(cache_file, 'rb') as f:
+      data = pickle.load(f)
+  except FileNotFoundError:
+    return {}
+  except Exception:
+    logger.warning('failed to load lilac.yaml cache, ignoring.', exc_info=True)
+    return {}
+
+  if data.get('fingerprint') != fingerprint:
+    logger.info('lilac.yaml cache is outdated, ignoring.')
+    return {}
+  return data['infos']
+
+def _save_cache(
+  cache_file: Path, fingerprint: str,
+  infos: dict[str, tuple[str, LilacInfo]],
+) -> None:
+  data = pickle.dumps({
+    'fingerprint': fingerprint,
+    'infos': infos,
+  })
+  try:
+    safe_overwrite(str(cache_file), data, mode='wb')
+  except OSError:
+    logger.warning('failed to save lilac.yaml cache.', exc_info=True)
+
 def load_lilacinfo(dir: Path, use_pacfiles: bool = False) -> LilacInfo:
   yamlconf = load_lilac_yaml(dir)
+  return lilacinfo_from_yaml(dir, yamlconf, use_pacfiles=use_pacfiles)
+
+def lilacinfo_from_yaml(
+  dir: Path, yamlconf: dict[str, Any], use_pacfiles: bool = False,
+) -> LilacInfo:
   if update_on := yamlconf.get('update_on'):
     update_ons, throttle_info = parse_update_on(update_on, use_pacfiles=use_pacfiles)
   else:
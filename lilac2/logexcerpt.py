@@ -0,0 +1,95 @@
+'''excerpts of build logs that may be too large to read into memory
+
+The log is mapped and only the parts needed are decoded.
+'''
+
+from __future__ import annotations
+
+import os
+import re
+import mmap
+from dataclasses import dataclass
+from typing import Optional
+
+# colours and "erase line" as gcc and rustc print them
+_ESC = rb'\x1b\[[0-9;]*[mK]'
+# compiler errors (error: or error[E0425]: for rustc) and makepkg errors
+ERROR_RE = re.compile(
+  rb'(?:' + _ESC + rb'|(?<!\w))error(?:\[\w+\])?(?:' + _ESC + rb')*:'
+  rb'|==> ERROR:',
+  re.IGNORECASE,
+)
+
+@dataclass
+class LogExcerpt:
+  head: str
+  # None if the head is the whole log
+  tail: Optional[str] = None
+  # lines around the first error in the part between head and tail
+  error: Optional[str] = None
+
+def _decode(data: bytes) -> str:
+  # we need to replace error characters because the mail will be
+  # strictly encoded, disallowing surrogate pairs
+  return data.decode('utf-8', errors='replace')
+
+def _char_start(data: bytes | mmap.mmap, pos: int) -> int:
+  '''move pos forward off UTF-8 continuation bytes'''
+  end = min(pos + 3, len(data))
+  while pos < end and 0x80 <= data[pos] < 0xc0:
+    pos += 1
+  return pos
+
+def _line_start(data: mmap.mmap, pos: int, lines: int, lo: int) -> int:
+  for _ in range(lines + 1):
+    nl = data.rfind(b'\n', lo, pos)
+    if nl < 0:
+      return lo
+    pos = nl
+  return pos + 1
+
+def _line_end(data: mmap.mmap, pos: int, lines: int, hi: int) -> int:
+  for _ in range(lines + 1):
+    nl = data.find(b'\n', pos, hi)
+    if nl < 0:
+      return hi
+    pos = nl + 1
+  return pos
+
+def read_log_excerpt(
+  path: os.PathLike,
+  head: int = 100 * 1024,
+  tail: int = 100 * 1024,
+  before: int = 5,
+  after: int = 20,
+) -> LogExcerpt:
+  '''read the first head and last tail bytes of the log at path
+
+  If the log is cut, the lines around the first error found in between are
+  also returned, `before` lines before it and `after` lines after it, up to
+  head bytes.
+  '''
+  with open(path, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    if size <= head + tail:
+      return LogExcerpt(_decode(f.read()))
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      tail_start = _char_start(data, size - tail)
+      head_end = head
+      # don't cut in the middle of a character
+      while head_end > 0 and 0x80 <= data[head_end] < 0xc0:
+        head_end -= 1
+
+      error = None
+      if m := ERROR_RE.search(data, head_end, tail_start):
+        start = _line_start(data, m.start(), before, head_end)
+        end = _line_end(data, m.end(), after, tail_start)
+        end = min(end, start + head)
+        error = _decode(data[start:end])
+
+      return LogExcerpt(
+        _decode(data[:head_end]),
+        _decode(data[tail_start:]),
+        error,
+      )
@@ -1,15 +1,163 @@
 from __future__ import annotations
 
+import os
+import time
+import email
 import smtplib
-from typing import Union, Type, List, Dict, Any
+import logging
+import itertools
+import threading
+from pathlib import Path
+from email.message import Message
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from typing import (
+  Union, Type, List, Dict, Any, Optional, Callable, Sequence, Tuple,
+)
 
 from .vendor.mailutils import assemble_mail
+from .vendor.myutils import safe_overwrite
 from . import intl
 
+logger = logging.getLogger(__name__)
+
 SMTPClient = Union[smtplib.SMTP, smtplib.SMTP_SSL]
 
+class MailQueue:
+  '''send mails in a background thread over one SMTP connection
+
+  Mails are written to the spool directory first and removed once sent.
+  Those not sent yet (e.g. the SMTP server is down) are retried with backoff,
+  and by the next run if lilac exits before that. Mails rejected by the
+  server, or failing temporarily MAX_ATTEMPTS times, are moved to the
+  "failed" subdirectory.
+  '''
+  # close the connection after this many seconds without mails
+  IDLE_TIMEOUT = 30
+  MAX_BACKOFF = 600
+  # tries for a mail that gets temporary errors while others can be sent
+  MAX_ATTEMPTS = 5
+
+  def __init__(self, spool: Path, connect: Callable[[], SMTPClient]) -> None:
+    spool.mkdir(parents=True, exist_ok=True)
+    self.spool = spool
+    self._connect = connect
+    self._conn: Optional[SMTPClient] = None
+    self._cond = threading.Condition()
+    self._thread: Optional[threading.Thread] = None
+    self._seq = itertools.count()
+    # mail file name => failed attempts
+    self._attempts: dict[str, int] = {}
+
+  def put(self, mail: Message) -> None:
+    name = f'{time.time_ns()}-{os.getpid()}-{next(self._seq)}.eml'
+    safe_overwrite(str(self.spool / name), mail.as_bytes(), mode='wb')
+    with self._cond:
+      self._start()
+      self._cond.notify_all()
+
+  def flush(self, timeout: Optional[float] = None) -> bool:
+    '''wait for spooled mails to be sent; return whether all have been sent'''
+    with self._cond:
+      if self._spooled():
+        self._start()
+      return self._cond.wait_for(lambda: not self._spooled(), timeout)
+
+  def _spooled(self) -> list[Path]:
+    # names sort by time
+    return sorted(self.spool.glob('*.eml'))
+
+  def _start(self) -> None:
+    if self._thread is None:
+      self._thread = threading.Thread(
+        target = self._run, name = 'mail-queue', daemon = True,
+      )
+      self._thread.start()
+
+  def _run(self) -> None:
+    backoff = 0
+    try:
+      while True:
+        with self._cond:
+          files = self._spooled()
+          if not files:
+            # wake up flush()
+            self._cond.notify_all()
+            if not self._cond.wait(self.IDLE_TIMEOUT):
+              self._disconnect()
+            continue
+
+        try:
+          self._send(files)
+          backoff = 0
+        except Exception:
+          backoff = min(max(backoff * 2, 5), self.MAX_BACKOFF)
+          logger.exception('failed to send mails, retrying in %ds', backoff)
+          self._disconnect()
+          time.sleep(backoff)
+    finally:
+      # let _start() run a new thread
+      with self._cond:
+        self._thread = None
+
+  def _send(self, files: list[Path]) -> None:
+    if self._conn is not None:
+      # the server may have closed an idle connection
+      try:
+        self._conn.noop()
+      except (smtplib.SMTPException, OSError):
+        self._disconnect()
+
+    for path in files:
+      mail = email.message_from_bytes(path.read_bytes())
+      if self._conn is None:
+        self._conn = self._connect()
+      try:
+        self._conn.send_message(mail)
+      except smtplib.SMTPRecipientsRefused as e:
+        self._reject(path, e)
+      except smtplib.SMTPResponseException as e:
+        if e.smtp_code < 500 and not self._tried_enough(path):
+          raise
+        self._reject(path, e)
+      except (smtplib.SMTPException, OSError):
+        # the connection is broken, not the mail
+        raise
+      except Exception as e:
+        if not self._tried_enough(path):
+          raise
+        self._reject(path, e)
+      else:
+        path.unlink()
+        self._attempts.pop(path.name, None)
+      with self._cond:
+        self._cond.notify_all()
+
+  def _tried_enough(self, path: Path) -> bool:
+    '''count a failed attempt; return whether to give up on the mail'''
+    n = self._attempts[path.name] = self._attempts.get(path.name, 0) + 1
+    return n >= self.MAX_ATTEMPTS
+
+  def _reject(self, path: Path, e: Exception) -> None:
+    logger.error('mail %s rejected: %r', path.name, e)
+    self._attempts.pop(path.name, None)
+    failed = self.spool / 'failed'
+    failed.mkdir(exist_ok=True)
+    path.rename(failed / path.name)
+
+  def _disconnect(self) -> None:
+    conn, self._conn = self._conn, None
+    if conn is None:
+      return
+    try:
+      conn.quit()
+    except (smtplib.SMTPException, OSError):
+      conn.close()
+
 class MailService:
-  def __init__(self, config: Dict[str, Any]) -> None:
+  def __init__(
+    self, config: Dict[str, Any], spool: Optional[Path] = None,
+  ) -> None:
     self.smtp_config = config['smtp']
     self.mailtag = config['lilac']['name']
     self.send_email = config['lilac']['send_email']
@@ -19,6 +167,10 @@ class MailService:
     self.from_ = f'{myname} <{myaddress}>'
     self.unsub = config['lilac'].get('unsubscribe_address')
 
+    self.queue: Optional[MailQueue] = None
+    if spool is not None and self.send_email:
+      self.queue = MailQueue(spool, self.smtp_connect)
+
   def smtp_connect(self) -> SMTPClient:
     config = self.smtp_config
     host = config.get('host', '')
@@ -38,12 +190,17 @@ class MailService:
       connection.login(username, password)
     return connection
 
-  def sendmail(self, to: Union[str, List[str]],
-               subject: str, msg: str) -> None:
+  def sendmail(
+    self, to: Union[str, List[str]], subject: str, msg: str,
+    attachments: Sequence[Tuple[str, bytes]] = (),
+  ) -> None:
+    '''send the mail, or queue it if a spool is configured
+
+    attachments are (filename, content) pairs.
+    '''
     if not self.send_email:
       return
 
-    s = self.smtp_connect()
     if len(msg) > 5 * 1024 ** 2:
       l10n = intl.get_l10n('mail')
       too_long = l10n.format_value('log-too-long')
@@ -51,8 +208,28 @@ class MailService:
           msg[-1024 ** 2:]
     mail = assemble_mail('[%s] %s' % (
       self.mailtag, subject), to, self.from_, text=msg)
+    if attachments:
+      parts: list[Message] = [mail]
+      for filename, data in attachments:
+        part = MIMEApplication(data)
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        parts.append(part)
+      mail = MIMEMultipart('mixed', _subparts = parts)
+      # move the headers from the text part
+      for h in ['Subject', 'From', 'To']:
+        mail[h] = parts[0][h]
+        del parts[0][h]
     if self.unsub:
       mail['List-Unsubscribe'] = f'<mailto:{self.unsub}?subject=unsubscribe>'
-    s.send_message(mail)
-    s.quit()
 
+    if self.queue is not None:
+      self.queue.put(mail)
+    else:
+      s = self.smtp_connect()
+      s.send_message(mail)
+      s.quit()
+
+  def flush(self, timeout: Optional[float] = None) -> bool:
+    if self.queue is None:
+      return True
+    return self.queue.flush(timeout)
@@ -9,7 +9,7 @@ from pathlib import Path
 from typing import (
   List, NamedTuple, Tuple, Set, Dict,
   Optional, Any, Union, Iterable, TYPE_CHECKING,
-  DefaultDict
+  DefaultDict, Callable,
 )
 
 import tomli_w
@@ -90,16 +90,36 @@ def _gen_config_from_lilacinfos(
 
   return newconfig, counts, errors
 
+def _nvresults(d: Dict[int, NvResult], n: int) -> NvResults:
+  nrs = NvResults()
+  for i in range(n):
+    if i in d:
+      nrs.append(d[i])
+    else:
+      # item at this index has failed; insert a dummy one
+      nrs.append(NvResult(None, None))
+  return nrs
+
 def packages_need_update(
   repo: Repo,
   proxy: Optional[str] = None,
   care_pkgs: set[str] = set(),
+  on_result: Optional[Callable[[str, Optional[NvResults]], None]] = None,
 ) -> Tuple[Dict[str, NvResults], Set[str], Set[str]]:
+  '''run nvchecker for packages (all or care_pkgs)
+
+  If given, on_result(pkgbase, nvresults) is called once for every package
+  as soon as all its entries are checked, so callers don't need to wait for
+  the slowest one. nvresults is None if its update_on is wrong or missing.
+  '''
   if care_pkgs:
     lilacinfos = {k: v for k, v in repo.lilacinfos.items() if k in care_pkgs}
   else:
     lilacinfos = repo.lilacinfos
   newconfig, update_on_counts, update_on_errors = _gen_config_from_lilacinfos(lilacinfos)
+  if on_result:
+    for pkg in update_on_errors:
+      on_result(pkg, None)
 
   if not OLDVER_FILE.exists():
     open(OLDVER_FILE, 'a').close()
@@ -136,6 +156,8 @@ def packages_need_update(
   nvdata_nested: Dict[str, Dict[int, NvResult]] = {}
   errors: DefaultDict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
   rebuild = set()
+  # pkgbase => entries not checked yet
+  unchecked = {k: set(range(n)) for k, n in update_on_counts.items()}
   for l in output:
     j = json.loads(l)
     pkg = j.get('name')
@@ -156,6 +178,22 @@ def packages_need_update(
       nvdata_nested[pkg][i] = NvResult(j['version'], j['version'])
     elif j['level'] in ['warning', 'warn', 'error', 'exception', 'critical']:
       errors[pkg].append(j)
+      if j['level'] in ['warning', 'warn']:
+        continue
+    else:
+      continue
+
+    if on_result and (left := unchecked.get(pkg)) is not None:
+      left.discard(i)
+      if not left:
+        del unchecked[pkg]
+        on_result(pkg, _nvresults(nvdata_nested[pkg], update_on_counts[pkg]))
+
+  if on_result:
+    # nvchecker has nothing more to say about these
+    for pkgbase in unchecked:
+      on_result(pkgbase, _nvresults(
+        nvdata_nested.get(pkgbase, {}), update_on_counts[pkgbase]))
 
   # don't rebuild if part of its checks have failed
   rebuild -= errors.keys()
@@ -204,14 +242,7 @@ def packages_need_update(
     if pkgbase is None:
       # from events without a name
       continue
-    n = update_on_counts[pkgbase]
-    nrs = nvdata[pkgbase] = NvResults()
-    for i in range(n):
-      if i in d:
-        nrs.append(d[i])
-      else:
-        # item at this index has failed; insert a dummy one
-        nrs.append(NvResult(None, None))
+    nvdata[pkgbase] = _nvresults(d, update_on_counts[pkgbase])
 
   for pkgbase in lilacinfos:
     if pkgbase not in nvdata:
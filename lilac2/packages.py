@@ -2,15 +2,17 @@ from __future__ import annotations
 
 from collections import defaultdict, namedtuple
 from pathlib import Path
-from typing import Dict, Union, Tuple, Set, Optional, DefaultDict
+from typing import Dict, Union, Tuple, Set, Optional, DefaultDict, FrozenSet
+from collections.abc import Mapping, Sequence, Iterator
+import os
 import re
 import graphlib
 from contextlib import suppress
 import logging
+import subprocess
 
 from .vendor import archpkg
 
-from .api import run_cmd
 from .typing import LilacInfos
 from . import lilacyaml
 
@@ -18,68 +20,101 @@ logger = logging.getLogger(__name__)
 
 def get_dependency_map(
   depman: DependencyManager, lilacinfos: LilacInfos,
-) -> Tuple[Dict[str, Set[Dependency]], Dict[str, Set[Dependency]]]:
+) -> Tuple[DependencyMap, DependencyMap]:
   '''compute ordered, complete dependency relations between pkgbases (the directory names)
 
   This function does not make use of pkgname because they maybe the same for
   different pkgdir. Those are carried by Dependency and used elsewhere.
 
-  The first returned dict has the complete set of dependencies of the given pkgbase, including
-  build-time dependencies of other dependencies. The second dict has only the dependnecies
+  The first returned map has the complete set of dependencies of the given pkgbase, including
+  build-time dependencies of other dependencies. The second map has only the dependnecies
   required to be installed in the build chroot. For example, if A depends on B, and B makedepends
-  on C, then the first dict has "A: {B, C}" while the second dict has only "A: {B}".
+  on C, then the first map has "A: {B, C}" while the second map has only "A: {B}".
   '''
-  map: DefaultDict[str, Set[Dependency]] = defaultdict(set)
-  pkgdir_map: DefaultDict[str, Set[str]] = defaultdict(set)
-  rmap: DefaultDict[str, Set[str]] = defaultdict(set)
+  # every Dependency gets a bit; sets of them are ints
+  deps: list[Dependency] = []
+  ids: Dict[Dependency, int] = {}
+  def bit(d: Dependency) -> int:
+    try:
+      i = ids[d]
+    except KeyError:
+      i = ids[d] = len(deps)
+      deps.append(d)
+    return 1 << i
 
-  # same as above maps, but contain only normal dependencies, not makedepends or checkdepends
-  norm_map: DefaultDict[str, Set[Dependency]] = defaultdict(set)
+  own: DefaultDict[str, int] = defaultdict(int)
+  pkgdir_map: DefaultDict[str, Set[str]] = defaultdict(set)
+  # same as above, but contain only normal dependencies, not makedepends or checkdepends
+  norm_own: DefaultDict[str, int] = defaultdict(int)
   norm_pkgdir_map: DefaultDict[str, Set[str]] = defaultdict(set)
-  norm_rmap: DefaultDict[str, Set[str]] = defaultdict(set)
 
   for pkgbase, info in lilacinfos.items():
     for d in info.repo_depends:
       d = depman.get(d)
-
+      b = bit(d)
+      own[pkgbase] |= b
       pkgdir_map[pkgbase].add(d.pkgdir.name)
-      rmap[d.pkgdir.name].add(pkgbase)
-      map[pkgbase].add(d)
-
+      norm_own[pkgbase] |= b
       norm_pkgdir_map[pkgbase].add(d.pkgdir.name)
-      norm_rmap[d.pkgdir.name].add(pkgbase)
-      norm_map[pkgbase].add(d)
 
     for d in info.repo_makedepends:
       d = depman.get(d)
-
+      own[pkgbase] |= bit(d)
       pkgdir_map[pkgbase].add(d.pkgdir.name)
-      rmap[d.pkgdir.name].add(pkgbase)
-      map[pkgbase].add(d)
 
+  # dependencies come before their dependers
+  map: Dict[str, int] = {}
+  norm_map: Dict[str, int] = {}
   dep_order = graphlib.TopologicalSorter(pkgdir_map).static_order()
   for pkgbase in dep_order:
-    if pkgbase in rmap:
-      deps = map[pkgbase]
-      dependers = rmap[pkgbase]
-      for dd in dependers:
-        map[dd].update(deps)
-    if pkgbase in norm_rmap:
-      deps = norm_map[pkgbase]
-      dependers = norm_rmap[pkgbase]
-      for dd in dependers:
-        norm_map[dd].update(deps)
-
-  build_dep_map: DefaultDict[str, Set[Dependency]] = defaultdict(set)
+    bits = own.get(pkgbase, 0)
+    for x in pkgdir_map.get(pkgbase, ()):
+      bits |= map[x]
+    map[pkgbase] = bits
+
+    bits = norm_own.get(pkgbase, 0)
+    for x in norm_pkgdir_map.get(pkgbase, ()):
+      bits |= norm_map[x]
+    norm_map[pkgbase] = bits
+
+  build_dep_map: Dict[str, int] = {}
   for pkgbase, info in lilacinfos.items():
-    build_deps = build_dep_map[pkgbase]
-    build_deps.update(norm_map[pkgbase])
+    bits = norm_map.get(pkgbase, 0)
     for d in info.repo_makedepends:
       d = depman.get(d)
-      build_deps.add(d)
-      build_deps.update(norm_map[d.pkgdir.name])
+      bits |= bit(d) | norm_map[d.pkgdir.name]
+    build_dep_map[pkgbase] = bits
+    map.setdefault(pkgbase, 0)
+
+  return DependencyMap(deps, map), DependencyMap(deps, build_dep_map)
 
-  return map, build_dep_map
+class DependencyMap(Mapping[str, FrozenSet['Dependency']]):
+  '''pkgbase -> set of Dependency, stored as bitsets
+
+  Sets are built on access. Unknown pkgbases have no dependencies.
+  '''
+  def __init__(self, deps: Sequence[Dependency], bits: Dict[str, int]) -> None:
+    self._deps = deps
+    self._bits = bits
+
+  def __getitem__(self, pkgbase: str) -> FrozenSet[Dependency]:
+    bits = self._bits.get(pkgbase, 0)
+    deps = self._deps
+    ret = []
+    while bits:
+      low = bits & -bits
+      ret.append(deps[low.bit_length() - 1])
+      bits ^= low
+    return frozenset(ret)
+
+  def __contains__(self, pkgbase: object) -> bool:
+    return pkgbase in self._bits
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self._bits)
+
+  def __len__(self) -> int:
+    return len(self._bits)
 
 _DependencyTuple = namedtuple(
   '_DependencyTuple', 'pkgdir pkgname')
@@ -89,18 +124,7 @@ class Dependency(_DependencyTuple):
   pkgname: str
 
   def resolve(self) -> Optional[Path]:
-    try:
-      files = [x for x in self.pkgdir.iterdir()
-              if x.name.endswith(('.pkg.tar.xz', '.pkg.tar.zst'))]
-    except FileNotFoundError:
-      return None
-
-    pkgs = []
-    for x in files:
-      info = archpkg.PkgNameInfo.parseFilename(x.name)
-      if info.name == self.pkgname:
-        pkgs.append(x)
-
+    pkgs = built_packages.get(self.pkgdir, self.pkgname)
     if len(pkgs) == 1:
       return pkgs[0]
     elif not pkgs:
@@ -109,6 +133,48 @@ class Dependency(_DependencyTuple):
       ret = max(pkgs, key=lambda x: x.stat().st_mtime)
       return ret
 
+class BuiltPackageIndex:
+  '''built package files in pkgdirs, indexed by package name
+
+  A pkgdir is scanned on first use. Call invalidate() when its package
+  files change.
+  '''
+  def __init__(self) -> None:
+    self._dirs: Dict[Path, Dict[str, list[Path]]] = {}
+
+  def get(self, pkgdir: Path, pkgname: str) -> list[Path]:
+    try:
+      files = self._dirs[pkgdir]
+    except KeyError:
+      files = self._dirs[pkgdir] = self._scan(pkgdir)
+    return files.get(pkgname, [])
+
+  def invalidate(self, pkgdir: Optional[Path] = None) -> None:
+    '''forget about pkgdir, or all pkgdirs if not given'''
+    if pkgdir is None:
+      self._dirs.clear()
+    else:
+      self._dirs.pop(pkgdir, None)
+
+  def _scan(self, pkgdir: Path) -> Dict[str, list[Path]]:
+    ret: DefaultDict[str, list[Path]] = defaultdict(list)
+    try:
+      files = [x for x in pkgdir.iterdir()
+              if x.name.endswith(('.pkg.tar.xz', '.pkg.tar.zst'))]
+    except FileNotFoundError:
+      return {}
+
+    for x in files:
+      try:
+        info = archpkg.PkgNameInfo.parseFilename(x.name)
+      except TypeError:
+        logger.warning('unrecognized package file: %r', x)
+        continue
+      ret[info.name].append(x)
+    return dict(ret)
+
+built_packages = BuiltPackageIndex()
+
 class DependencyManager:
   _CACHE: Dict[str, Dependency] = {}
 
@@ -127,11 +193,37 @@ class DependencyManager:
         self.repodir / pkgbase, pkgname)
     return self._CACHE[key]
 
-def get_changed_packages(from_: str, to: str) -> Set[str]:
-  cmd = ["git", "diff", "--name-only", '--relative', from_, to]
-  r = run_cmd(cmd).splitlines()
-  ret = {x.split('/', 1)[0] for x in r}
-  return ret
+def get_changed_packages(from_: str, to: str) -> Tuple[Set[str], Set[str]]:
+  '''pkgbases changed between two commits, and those whose PKGBUILD gained a pkgrel= line
+
+  Both come from a single streamed ``git diff``.
+  '''
+  cmd = [
+    "git", "-c", "core.quotePath=false", "diff", "-p", "--no-color",
+    "--no-ext-diff", "--no-renames", "--relative", from_, to,
+  ]
+  changed: Set[str] = set()
+  pkgrel_changed: Set[str] = set()
+
+  # changed files may be in any encoding; only paths are decoded
+  p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+  assert p.stdout
+  with p:
+    path = ''
+    for l in p.stdout:
+      if l.startswith(b'diff --git '):
+        # "a/path b/path" with the same path twice since renames are off
+        rest = os.fsdecode(l[len(b'diff --git '):].rstrip(b'\n'))
+        path = rest[2:2 + (len(rest) - 5) // 2]
+        changed.add(path.split('/', 1)[0])
+      elif l.startswith(b'+pkgrel='):
+        pkgbase, _, name = path.partition('/')
+        if name == 'PKGBUILD':
+          pkgrel_changed.add(pkgbase)
+
+  if p.returncode != 0:
+    raise subprocess.CalledProcessError(p.returncode, cmd)
+  return changed, pkgrel_changed
 
 _re_package = re.compile(r'package(?:_(.+))?\(')
 
@@ -5,23 +5,25 @@ from __future__ import annotations
 import os
 import time
 import subprocess
-from typing import Dict, List, Optional, Union
+import hashlib
+import dataclasses
+from typing import Dict, List, Optional, Union, Any
+from collections.abc import Container, Iterable
 from pathlib import Path
 from contextlib import suppress
 import logging
 
-import pyalpm
-
 from .vendor.myutils import safe_overwrite
 
 from .const import _G, OFFICIAL_REPOS
 from .cmd import UNTRUSTED_PREFIX
 from .typing import PkgVers
+from .sortedindex import SortedIndex, write_index
 
 logger = logging.getLogger(__name__)
-_official_packages: Dict[str, int] = {}
-_official_groups: Dict[str, int] = {}
-_repo_package_versions: Dict[str, str] = {}
+_official_packages: Container[str] = frozenset()
+_official_groups: Container[str] = frozenset()
+_repo_package_versions: Union[SortedIndex, Dict[str, str]] = {}
 
 class ConflictWithOfficialError(Exception):
   def __init__(self, groups, packages):
@@ -83,8 +85,14 @@ def update_pacmandb(
 def update_data(
   pacman_conf: Optional[str], *,
   quiet: bool = False, update_pacfiles: bool = False,
+  reponame: Optional[str] = None,
 ) -> None:
+  '''update pacman databases and the indexes load_data uses'''
+  import pyalpm
+
   from .const import PACMAN_DB_DIR
+  if reponame is None:
+    reponame = getattr(_G, 'reponame', None)
   dbpath = PACMAN_DB_DIR
   update_pacmandb(dbpath, pacman_conf,
                   quiet=quiet, update_pacfiles=update_pacfiles)
@@ -103,22 +111,35 @@ def update_data(
   _save_timed_dict(dbpath / 'packages.txt', pkgs)
   _save_timed_dict(dbpath / 'groups.txt', groups)
 
+  write_index(dbpath / 'packages.idx', ((p, '') for p in pkgs))
+  write_index(dbpath / 'groups.idx', ((g, '') for g in groups))
+  if reponame:
+    db = H.register_syncdb(reponame, 0)
+    write_index(
+      dbpath / f'repo-{reponame}.idx',
+      ((p.name, p.version) for p in db.pkgcache),
+    )
+
 def load_data(dbpath: Path) -> None:
-  global _repo_package_versions
+  '''open the indexes written by update_data'''
+  global _official_packages, _official_groups, _repo_package_versions
 
-  now = int(time.time())
-  deadline = now - 90 * 86400
-  _official_packages.update(
-    _load_timed_dict(dbpath / 'packages.txt', deadline))
-  _official_groups.update(
-    _load_timed_dict(dbpath / 'groups.txt', deadline))
+  _official_packages = SortedIndex(dbpath / 'packages.idx')
+  _official_groups = SortedIndex(dbpath / 'groups.idx')
 
   if hasattr(_G, 'reponame'):
-    H = pyalpm.Handle('/', str(dbpath))
-    db = H.register_syncdb(_G.reponame, 0)
-    _repo_package_versions = {p.name: p.version for p in db.pkgcache}
+    try:
+      _repo_package_versions = SortedIndex(dbpath / f'repo-{_G.reponame}.idx')
+    except FileNotFoundError:
+      # update_data didn't know the repository name
+      import pyalpm
+      H = pyalpm.Handle('/', str(dbpath))
+      db = H.register_syncdb(_G.reponame, 0)
+      _repo_package_versions = {p.name: p.version for p in db.pkgcache}
 
 def check_srcinfo() -> PkgVers:
+  import pyalpm
+
   srcinfo = get_srcinfo().decode('utf-8').splitlines()
   bad_groups = []
   bad_packages = []
@@ -143,22 +164,55 @@ def check_srcinfo() -> PkgVers:
   # package in repos or not
   built_version = str(pkgvers)
   for pkgname in pkgnames:
-    try:
-      repo_version = _repo_package_versions[pkgname]
-      logger.debug('comparing versions: built=%s, repo=%s',
-                   built_version, repo_version)
-      if pyalpm.vercmp(built_version, repo_version) <= 0:
-        raise DowngradingError(pkgname, built_version, repo_version)
-    except KeyError:
+    repo_version = _repo_package_versions.get(pkgname)
+    if repo_version is None:
       logger.debug('new package: %s %s', pkgname, built_version)
       # the newly built package is not in repos yet - fine
+      continue
+    logger.debug('comparing versions: built=%s, repo=%s',
+                 built_version, repo_version)
+    if pyalpm.vercmp(built_version, repo_version) <= 0:
+      raise DowngradingError(pkgname, built_version, repo_version)
 
   if bad_groups or bad_packages:
     raise ConflictWithOfficialError(bad_groups, bad_packages)
 
   return pkgvers
 
+# Results of running PKGBUILD in the sandbox for the current directory, keyed
+# by the content of the PKGBUILD. Files it sources are not taken into account.
+_CacheKey = tuple[str, bytes]
+_srcinfo_cache: dict[_CacheKey, bytes] = {}
+_eval_cache: dict[_CacheKey, PkgbuildValues] = {}
+_CACHE_SIZE = 16
+
+# read together on the first evaluation of a PKGBUILD
+_SCALARS = ('pkgver', 'pkgrel', 'epoch')
+_ARRAYS = (
+  'arch', 'license', 'groups', 'depends', 'makedepends', 'checkdepends',
+  'optdepends', 'provides', 'conflicts', 'replaces', 'source', 'validpgpkeys',
+)
+
+def _cache_key() -> Optional[_CacheKey]:
+  try:
+    with open('PKGBUILD', 'rb') as f:
+      return os.getcwd(), hashlib.sha256(f.read()).digest()
+  except FileNotFoundError:
+    return None
+
+def _cache_put(cache: dict[_CacheKey, Any], key: Optional[_CacheKey], value: Any) -> None:
+  if key is None:
+    return
+  if len(cache) >= _CACHE_SIZE:
+    # remove the oldest
+    del cache[next(iter(cache))]
+  cache[key] = value
+
 def get_srcinfo() -> bytes:
+  key = _cache_key()
+  if key is not None and (out := _srcinfo_cache.get(key)) is not None:
+    return out
+
   pwd = os.getcwd()
   basename = os.path.basename(pwd)
   # makepkg wants *.install file and write permissions to simply print out info :-(
@@ -166,8 +220,108 @@ def get_srcinfo() -> bytes:
   out = subprocess.check_output(
     UNTRUSTED_PREFIX + extra_binds + ['makepkg', '--printsrcinfo'], # type: ignore
   )
+  _cache_put(_srcinfo_cache, key, out)
   return out
 
+@dataclasses.dataclass
+class PkgbuildValues:
+  '''variables of a sourced PKGBUILD'''
+  # None for unset scalars
+  scalars: dict[str, Optional[str]]
+  # None for unset or empty arrays
+  arrays: dict[str, Optional[list[str]]]
+  # sourcing PKGBUILD failed
+  error: Optional[subprocess.CalledProcessError] = None
+
+  def copy(self) -> PkgbuildValues:
+    '''a copy whose lists can be changed without affecting the cache'''
+    return PkgbuildValues(
+      dict(self.scalars),
+      {k: list(v) if v is not None else None for k, v in self.arrays.items()},
+      self.error,
+    )
+
+# output goes to fd 3 so that what PKGBUILD prints doesn't get mixed in
+_EVAL_SCRIPT = '''\
+exec 3>&1 >/dev/null
+source PKGBUILD || exit
+for _v in $1; do
+  if [[ -v $_v ]]; then
+    printf 'S\\0%s\\0%s\\0' "$_v" "${!_v}" >&3
+  else
+    printf 'U\\0%s\\0' "$_v" >&3
+  fi
+done
+for _v in $2; do
+  eval "_a=(\\"\\${$_v[@]}\\")"
+  printf 'A\\0%s\\0%s\\0' "$_v" "${#_a[@]}" >&3
+  (( ${#_a[@]} )) && printf '%s\\0' "${_a[@]}" >&3
+done
+exit 0
+'''
+
+def _evaluate(scalars: Iterable[str], arrays: Iterable[str]) -> PkgbuildValues:
+  pwd = os.getcwd()
+  basename = os.path.basename(pwd)
+  extra_binds = ['--ro-bind', pwd, f'/tmp/{basename}', '--chdir', f'/tmp/{basename}']
+  cmd = UNTRUSTED_PREFIX + extra_binds + [ # type: ignore
+    '/bin/bash', '-c', _EVAL_SCRIPT, 'bash', ' '.join(scalars), ' '.join(arrays),
+  ]
+  p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  r = PkgbuildValues({}, {})
+  if p.returncode != 0:
+    r.error = subprocess.CalledProcessError(p.returncode, cmd, p.stdout, p.stderr)
+    return r
+
+  it = iter(p.stdout.decode(errors='surrogateescape').split('\0')[:-1])
+  for kind in it:
+    name = next(it)
+    if kind == 'S':
+      r.scalars[name] = next(it)
+    elif kind == 'U':
+      r.scalars[name] = None
+    else:
+      values = [next(it) for _ in range(int(next(it)))]
+      r.arrays[name] = values if values and values != [''] else None
+  return r
+
+def evaluate_pkgbuild(
+  arrays: Iterable[str] = (), scalars: Iterable[str] = (),
+) -> PkgbuildValues:
+  '''source PKGBUILD in the sandbox and get the named arrays and scalars
+
+  pkgver, pkgrel, epoch and commonly used arrays are always read. Results
+  are reused until PKGBUILD changes; variables not read before are read
+  together in one more run. The values returned are copies.
+  '''
+  arrays = list(dict.fromkeys(arrays))
+  scalars = list(dict.fromkeys(scalars))
+  for name in arrays + scalars:
+    if not name.isidentifier():
+      raise ValueError('bad variable name', name)
+
+  key = _cache_key()
+  r = _eval_cache.get(key) if key is not None else None
+  if r is None:
+    r = _evaluate(
+      dict.fromkeys([*_SCALARS, *scalars]),
+      dict.fromkeys([*_ARRAYS, *arrays]),
+    )
+    _cache_put(_eval_cache, key, r)
+    return r.copy()
+
+  if r.error is not None:
+    return r.copy()
+  missing_arrays = [a for a in arrays if a not in r.arrays]
+  missing_scalars = [x for x in scalars if x not in r.scalars]
+  if missing_arrays or missing_scalars:
+    r2 = _evaluate(missing_scalars, missing_arrays)
+    if r2.error is not None:
+      return r2
+    r.arrays.update(r2.arrays)
+    r.scalars.update(r2.scalars)
+  return r.copy()
+
 def _get_package_version(srcinfo: List[str]) -> PkgVers:
   epoch = pkgver = pkgrel = None
 
@@ -186,5 +340,6 @@ def _get_package_version(srcinfo: List[str]) -> PkgVers:
 
 if __name__ == '__main__':
   import sys
-  conf = sys.argv[1] if len(sys.argv) == 2 else None
-  update_data(conf)
+  conf = sys.argv[1] or None if len(sys.argv) >= 2 else None
+  reponame = sys.argv[2] if len(sys.argv) >= 3 else None
+  update_data(conf, reponame=reponame)
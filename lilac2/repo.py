@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import os
+import gzip
 import subprocess
+import threading
 from pathlib import Path
 from typing import (
-  Optional, Tuple, List, Union, Dict, TYPE_CHECKING, Any,
+  Optional, Tuple, List, Union, Dict, TYPE_CHECKING, Any, Sequence,
 )
 import logging
 from functools import lru_cache
@@ -18,8 +20,10 @@ import structlog
 from .vendor.github import GitHub
 
 from .mail import MailService
+from .logexcerpt import read_log_excerpt
 from .packages import get_built_package_files
 from .tools import ansi_escape_re, has_pacfiles
+from .const import mydir
 from . import lilacyaml, intl
 from .typing import LilacMod, Maintainer, LilacInfos, LilacInfo
 from .nomypy import BuildResult # type: ignore
@@ -31,6 +35,36 @@ logger = logging.getLogger(__name__)
 build_logger_old = logging.getLogger('build')
 build_logger = structlog.get_logger(logger_name='build')
 
+# digest mails are split to stay below the size MailService cuts mails at
+DIGEST_MAX_SIZE = 4 * 1024 ** 2
+
+def _split_digest(
+  entries: list[tuple[str, str, Sequence[tuple[str, bytes]]]],
+) -> list[list[tuple[int, str, str, list[tuple[str, bytes]]]]]:
+  '''number the entries and group them into mails of bounded size
+
+  Reports too large for a mail are attached gzipped.
+  '''
+  l10n = intl.get_l10n('mail')
+  mails = []
+  cur: list[tuple[int, str, str, list[tuple[str, bytes]]]] = []
+  size = 0
+  for i, (subject, msg, atts) in enumerate(entries, 1):
+    atts = list(atts)
+    if len(msg) > DIGEST_MAX_SIZE:
+      atts.append((f'{i}-report.txt.gz', gzip.compress(msg.encode())))
+      msg = l10n.format_value('digest-report-attached')
+    # attachments are base64 encoded
+    n = len(subject) + len(msg) + sum(len(d) for _, d in atts) * 4 // 3
+    if cur and size + n > DIGEST_MAX_SIZE:
+      mails.append(cur)
+      cur, size = [], 0
+    cur.append((i, subject, msg, atts))
+    size += n
+  if cur:
+    mails.append(cur)
+  return mails
+
 class Repo:
   gh: Optional[GitHub]
 
@@ -48,7 +82,13 @@ class Repo:
     self.bindmounts = config.get('bindmounts', [])
     self.tmpfs = config.get('misc', {}).get('tmpfs', [])
 
-    self.ms = MailService(config)
+    self.ms = MailService(config, spool=mydir / 'mailspool')
+    self.mail_digest = config['lilac'].get('mail_digest', False)
+    # recipient -> [(subject, msg, attachments)] while collecting digests
+    self._digests: Optional[dict[
+      str, list[tuple[str, str, Sequence[tuple[str, bytes]]]]
+    ]] = None
+    self._digest_lock = threading.Lock()
     github_token = config['lilac'].get('github_token')
     if github_token:
       self.gh = GitHub(github_token)
@@ -268,6 +308,7 @@ class Repo:
       pkgbase = mod.pkgbase
 
     msgs = []
+    attachments = []
     if msg is not None:
       msgs.append(msg)
 
@@ -303,18 +344,17 @@ class Repo:
 
     if logfile:
       with suppress(FileNotFoundError):
-        # we need to replace error characters because the mail will be
-        # strictly encoded, disallowing surrogate pairs
-        with logfile.open(errors='replace') as f:
-          build_output = f.read()
-
-        if len(build_output) > 200 * 1024:
-          too_long = l10n.format_value('log-too-long')
-          build_output = (
-            build_output[:100 * 1024]
-            + '\n\n' + too_long + '\n\n'
-            + build_output[-100 * 1024:]
-          )
+        excerpt = read_log_excerpt(logfile)
+        build_output = excerpt.head
+        if excerpt.tail is not None:
+          too_long = '\n\n' + l10n.format_value('log-too-long') + '\n\n'
+          build_output += too_long
+          if excerpt.error is not None:
+            build_output += (
+              l10n.format_value('log-first-error') + '\n\n'
+              + excerpt.error + too_long
+            )
+          build_output += excerpt.tail
 
         if build_output:
           log_header = l10n.format_value('packaging-log')
@@ -328,7 +368,14 @@ class Repo:
               )
               log_header += ' ' + logurl
           msgs.append(log_header)
-          msgs.append('\n' + build_output)
+          with self._digest_lock:
+            digesting = self._digests is not None
+          if digesting:
+            attachments.append((
+              f'{pkgbase}.log.gz', gzip.compress(build_output.encode()),
+            ))
+          else:
+            msgs.append('\n' + build_output)
 
     msg = '\n'.join(msgs)
     if self.trim_ansi_codes:
@@ -337,13 +384,56 @@ class Repo:
     addresses = [str(x) for x in maintainers]
     logger.debug('mail to %s:\nsubject: %s\nbody: %s',
                  addresses, subject_real, msg[:200])
-    self.sendmail(addresses, subject_real, msg)
+    self.sendmail(addresses, subject_real, msg, attachments)
 
-  def sendmail(self, who: Union[str, List[str], Maintainer],
-               subject: str, msg: str) -> None:
+  def sendmail(
+    self, who: Union[str, List[str], Maintainer], subject: str, msg: str,
+    attachments: Sequence[tuple[str, bytes]] = (),
+  ) -> None:
     if isinstance(who, Maintainer):
       who = str(who)
-    self.ms.sendmail(who, subject, msg)
+    with self._digest_lock:
+      if self._digests is not None:
+        for addr in [who] if isinstance(who, str) else who:
+          self._digests.setdefault(addr, []).append((subject, msg, attachments))
+        return
+    self.ms.sendmail(who, subject, msg, attachments)
+
+  def begin_digest(self) -> None:
+    '''collect mails to maintainers until send_digests if mail_digest is set'''
+    if self.mail_digest:
+      with self._digest_lock:
+        self._digests = {}
+
+  def send_digests(self) -> None:
+    '''send one mail to each recipient with the mails collected'''
+    with self._digest_lock:
+      digests, self._digests = self._digests, None
+    if not digests:
+      return
+
+    l10n = intl.get_l10n('mail')
+    for who, entries in digests.items():
+      if len(entries) == 1:
+        self.ms.sendmail(who, *entries[0])
+        continue
+
+      for mail in _split_digest(entries):
+        subject = l10n.format_value('digest-subject', {'count': len(mail)})
+        toc = '\n'.join(f'{i}. {s}' for i, s, _, _ in mail)
+        parts = [toc]
+        attachments: list[tuple[str, bytes]] = []
+        names: set[str] = set()
+        for i, s, m, atts in mail:
+          parts.append(f'{i}. {s}\n\n{m}')
+          for name, data in atts:
+            if name in names:
+              name = f'{i}-{name}'
+            names.add(name)
+            attachments.append((name, data))
+        msg = ('\n\n' + '=' * 72 + '\n\n').join(parts)
+        logger.info('sending a digest of %d mails to %s', len(mail), who)
+        self.ms.sendmail(who, subject, msg, attachments)
 
   def send_repo_mail(self, subject: str, msg: str) -> None:
     self.ms.sendmail(self.repomail, subject, msg)
@@ -353,18 +443,25 @@ class Repo:
 
   def load_managed_lilac_and_report(self) -> dict[str, tuple[str, ...]]:
     self.lilacinfos, errors = lilacyaml.load_managed_lilacinfos(
-      self.repodir, use_pacfiles=has_pacfiles())
+      self.repodir, use_pacfiles=has_pacfiles(),
+      cache_file=mydir / 'lilacinfos.cache',
+    )
     failed: dict[str, tuple[str, ...]] = {p: () for p in errors}
     l10n = intl.get_l10n('mail')
     for name, exc_info in errors.items():
-      logger.error('error while loading lilac.yaml for %s', name, exc_info=exc_info)
       exc = exc_info[1]
+      if isinstance(exc, SyntaxError) and str(exc.filename).endswith('lilac.py'):
+        what = 'lilac.py'
+        subject = l10n.format_value('lilac-py-loading-error')
+      else:
+        what = 'lilac.yaml'
+        subject = l10n.format_value('lilac-yaml-loadding-error')
+      logger.error('error while loading %s for %s', what, name, exc_info=exc_info)
       if not isinstance(exc, Exception):
         raise
-      self.send_error_report(name, exc=exc,
-                             subject=l10n.format_value('lilac-yaml-loadding-error'))
+      self.send_error_report(name, exc=exc, subject=subject)
       build_logger_old.error('%s failed', name)
-      build_logger.exception('lilac.yaml error', pkgbase = name, exc_info=exc_info)
+      build_logger.exception(f'{what} error', pkgbase = name, exc_info=exc_info)
 
     return failed
 
@@ -0,0 +1,52 @@
+'''sorted "key value" line files, looked up in place with mmap and binary search
+
+Written once and then read by many processes, which share the pages instead
+of each building a dict.
+'''
+
+from __future__ import annotations
+
+import os
+import mmap
+from typing import Iterable, Optional, Union
+
+from .vendor.myutils import safe_overwrite
+
+def write_index(path: os.PathLike, items: Iterable[tuple[str, str]]) -> None:
+  '''keys must not contain whitespace; values may be empty'''
+  lines = sorted(
+    (f'{k} {v}'.encode() if v else k.encode()) + b'\n'
+    for k, v in items
+  )
+  safe_overwrite(os.fspath(path), b''.join(lines), mode='wb')
+
+class SortedIndex:
+  def __init__(self, path: os.PathLike) -> None:
+    self._data: Union[mmap.mmap, bytes]
+    with open(path, 'rb') as f:
+      if os.fstat(f.fileno()).st_size:
+        self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      else:
+        # empty files can't be mapped
+        self._data = b''
+
+  def get(self, key: str) -> Optional[str]:
+    k = key.encode()
+    data = self._data
+    # lo and hi are always at the start of a line
+    lo, hi = 0, len(data)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      start = data.rfind(b'\n', lo, mid) + 1 or lo
+      end = data.find(b'\n', start)
+      line_key, _, value = data[start:end].partition(b' ')
+      if line_key == k:
+        return value.decode()
+      elif line_key < k:
+        lo = end + 1
+      else:
+        hi = start
+    return None
+
+  def __contains__(self, key: object) -> bool:
+    return isinstance(key, str) and self.get(key) is not None
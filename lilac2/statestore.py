@@ -0,0 +1,122 @@
+'''state kept between batches, in SQLite
+
+Entries are updated one by one as they change instead of rewriting the
+whole state at the end of a batch.
+'''
+
+from __future__ import annotations
+
+import os
+import json
+import pickle
+import sqlite3
+import threading
+import logging
+from pathlib import Path
+from typing import Any, Iterable
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+create table if not exists state (
+  key text primary key,
+  value text not null
+);
+create table if not exists failed (
+  pkgbase text primary key,
+  version text,
+  missing text not null
+);
+create table if not exists fingerprints (
+  pkgbase text primary key,
+  fingerprint text not null
+);
+'''
+
+class StateStore:
+  def __init__(self, path: Path) -> None:
+    # written from build threads
+    self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._lock = threading.Lock()
+    with self._lock:
+      self._conn.execute('pragma journal_mode = wal')
+      self._conn.execute('pragma synchronous = normal')
+      self._conn.executescript(SCHEMA)
+
+  def close(self) -> None:
+    self._conn.close()
+
+  def _transaction(self, sqls: Iterable[tuple[str, tuple[Any, ...]]]) -> None:
+    with self._lock:
+      c = self._conn
+      c.execute('begin')
+      try:
+        for sql, args in sqls:
+          c.execute(sql, args)
+      except BaseException:
+        c.execute('rollback')
+        raise
+      c.execute('commit')
+
+  def get(self, key: str, default: Any = None) -> Any:
+    with self._lock:
+      row = self._conn.execute(
+        'select value from state where key = ?', (key,)).fetchone()
+    if row is None:
+      return default
+    return json.loads(row[0])
+
+  def set(self, key: str, value: Any) -> None:
+    self._transaction([(
+      'insert or replace into state (key, value) values (?, ?)',
+      (key, json.dumps(value)),
+    )])
+
+  def get_failed(self) -> dict[str, dict[str, Any]]:
+    '''pkgbase -> {'version': ..., 'missing': (dependencies, ...)}'''
+    with self._lock:
+      rows = self._conn.execute(
+        'select pkgbase, version, missing from failed').fetchall()
+    return {
+      p: {'version': v, 'missing': tuple(json.loads(m))}
+      for p, v, m in rows
+    }
+
+  def update_failed(
+    self,
+    failed: dict[str, dict[str, Any]],
+    removed: Iterable[str] = (),
+  ) -> None:
+    '''record failed packages and forget removed ones'''
+    sqls: list[tuple[str, tuple[Any, ...]]] = [(
+      'insert or replace into failed (pkgbase, version, missing) values (?, ?, ?)',
+      (p, i['version'], json.dumps(list(i['missing']))),
+    ) for p, i in failed.items()]
+    sqls.extend(('delete from failed where pkgbase = ?', (p,)) for p in removed)
+    self._transaction(sqls)
+
+  def get_fingerprints(self) -> dict[str, str]:
+    with self._lock:
+      return dict(self._conn.execute(
+        'select pkgbase, fingerprint from fingerprints').fetchall())
+
+  def update_fingerprints(
+    self, fingerprints: dict[str, str], removed: Iterable[str] = (),
+  ) -> None:
+    sqls: list[tuple[str, tuple[Any, ...]]] = [(
+      'insert or replace into fingerprints (pkgbase, fingerprint) values (?, ?)',
+      (p, fp),
+    ) for p, fp in fingerprints.items()]
+    sqls.extend(('delete from fingerprints where pkgbase = ?', (p,)) for p in removed)
+    self._transaction(sqls)
+
+  def import_pickled(self, path: Path) -> None:
+    '''import the pickled store used before, and rename it away'''
+    with open(path, 'rb') as f:
+      data = pickle.load(f)
+    logger.info('importing state from %s', path)
+    if (last_commit := data.get('last_commit')) is not None:
+      self.set('last_commit', last_commit)
+    self.update_failed(data.get('failed', {}))
+    self.update_fingerprints(data.get('build_fingerprints', {}))
+    os.rename(path, path.with_name(path.name + '.imported'))
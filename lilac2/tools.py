@@ -2,11 +2,15 @@ from __future__ import annotations
 
 import re
 import subprocess
-from typing import Dict, Any
+from typing import Dict, Any, Callable, NamedTuple, Optional, cast
 import os
 import logging
 from contextlib import suppress
 import time
+import threading
+from collections import deque
+import json
+import sys
 
 import tomllib
 
@@ -51,6 +55,109 @@ def get_avail_memory() -> int:
         return int(l.split()[1]) * 1024
   return 10 *  1024 ** 3
 
+def get_pressure(resource: str) -> float:
+  '''"some avg10" pressure stall information of cpu, memory or io in percent
+
+  0 if PSI is not available.
+  '''
+  try:
+    with open(f'/proc/pressure/{resource}') as f:
+      for l in f:
+        if l.startswith('some '):
+          for kv in l.split()[1:]:
+            k, v = kv.split('=', 1)
+            if k == 'avg10':
+              return float(v)
+  except OSError:
+    pass
+  return 0.0
+
+class ResourceStats(NamedTuple):
+  # busy ratio of the last sampling interval
+  cpu_ratio: float
+  # mean busy ratio over the sampling window
+  cpu_ratio_avg: float
+  memory_avail: int
+  # lowest available memory over the sampling window
+  memory_avail_min: int
+  # pressure stall percentages (10s averages)
+  cpu_pressure: float
+  memory_pressure: float
+
+  def usage(self, cpu_pressure: bool = False) -> tuple[float, int]:
+    '''(cpu_ratio, memory_avail) as used by the scheduler
+
+    With cpu_pressure, tasks waiting for CPU push cpu_ratio over 1.0.
+    '''
+    cpu = self.cpu_ratio_avg
+    if cpu_pressure:
+      cpu += self.cpu_pressure / 100
+    return cpu, self.memory_avail
+
+def get_resource_usage(cpu_pressure: bool = False) -> tuple[float, int]:
+  '''blocking version of ResourceSampler.get_stats().usage()'''
+  cpu = get_running_task_cpu_ratio()
+  if cpu_pressure:
+    cpu += get_pressure('cpu') / 100
+  return cpu, get_avail_memory()
+
+class ResourceSampler(threading.Thread):
+  '''sample CPU and memory usage every `interval` seconds in the background
+
+  Statistics over the last `window` samples are kept and `callback(stats)`
+  is called after each sample.
+  '''
+  def __init__(
+    self,
+    callback: Optional[Callable[[ResourceStats], None]] = None,
+    interval: float = 1.0,
+    window: int = 5,
+  ) -> None:
+    super().__init__(name='resource-sampler', daemon=True)
+    self.callback = callback
+    self.interval = interval
+    self.samples: deque[tuple[float, int]] = deque(maxlen=window)
+    self.stats: Optional[ResourceStats] = None
+    self._has_stats = threading.Event()
+    self._stopping = threading.Event()
+
+  def run(self) -> None:
+    a = get_cpu_idle()
+    while not self._stopping.wait(self.interval):
+      b = get_cpu_idle()
+      if b[1] == a[1]:
+        continue
+      cpu_ratio = 1 - (b[0] - a[0]) / (b[1] - a[1])
+      a = b
+      memory_avail = get_avail_memory()
+
+      self.samples.append((cpu_ratio, memory_avail))
+      # replaced as a whole so readers always see a consistent one
+      self.stats = ResourceStats(
+        cpu_ratio = cpu_ratio,
+        cpu_ratio_avg = sum(x[0] for x in self.samples) / len(self.samples),
+        memory_avail = memory_avail,
+        memory_avail_min = min(x[1] for x in self.samples),
+        cpu_pressure = get_pressure('cpu'),
+        memory_pressure = get_pressure('memory'),
+      )
+      self._has_stats.set()
+
+      if self.callback is not None:
+        try:
+          self.callback(self.stats)
+        except Exception:
+          logger.exception('error in resource sampler callback')
+
+  def get_stats(self) -> ResourceStats:
+    '''latest statistics; only the first call may wait for a sample'''
+    self._has_stats.wait()
+    return cast(ResourceStats, self.stats)
+
+  def stop(self) -> None:
+    self._stopping.set()
+    self.join()
+
 _HAS_PACFILES = None
 
 def has_pacfiles() -> bool:
@@ -63,7 +170,22 @@ def has_pacfiles() -> bool:
       _HAS_PACFILES = False
   return _HAS_PACFILES
 
+def stream_resource_stats(interval: float = 1.0) -> None:
+  '''print ResourceStats as JSON lines until stdin is closed
+
+  Used as a long-running agent on remote workers.
+  '''
+  def output(stats: ResourceStats) -> None:
+    print(json.dumps(stats._asdict()), flush=True)
+
+  sampler = ResourceSampler(output, interval)
+  sampler.start()
+  # the other end has gone away when stdin is closed
+  sys.stdin.read()
+
 if __name__ == '__main__':
-  cpu = get_running_task_cpu_ratio()
-  mem = get_avail_memory()
-  print(cpu, mem)
+  if sys.argv[1:2] == ['--stream']:
+    stream_resource_stats()
+  else:
+    cpu, mem = get_resource_usage(cpu_pressure='--cpu-pressure' in sys.argv)
+    print(cpu, mem)
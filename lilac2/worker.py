@@ -14,8 +14,6 @@ import traceback
 from functools import partial
 import dataclasses
 
-import pyalpm
-
 from .vendor.nicelogger import enable_pretty_logging
 from .vendor.myutils import file_lock
 
@@ -50,6 +48,8 @@ def may_update_pkgrel() -> Generator[None, None, None]:
   if pkgver2 is None or pkgrel2 is None:
     return
 
+  import pyalpm
+
   if pkgver == pkgver2 and \
      pyalpm.vercmp(f'1-{pkgrel}', f'1-{pkgrel2}') >= 0:
     try:
@@ -211,7 +211,8 @@ def run_build_cmd(cmd: Cmd) -> None:
         raise subprocess.CalledProcessError(code, cmd)
       break
 
-def main() -> None:
+def main(data_loaded: bool = False) -> None:
+  '''data_loaded: pkgbuild.load_data has been called (by the forkserver)'''
   enable_pretty_logging('DEBUG')
 
   input = json.load(sys.stdin)
@@ -222,11 +223,12 @@ def main() -> None:
   reports: list[Report] = []
   _G.add_report = partial(add_report, reports)
 
-  # after _G.reponame is set
-  pkgbuild.load_data(PACMAN_DB_DIR)
+  if not data_loaded:
+    # after _G.reponame is set
+    pkgbuild.load_data(PACMAN_DB_DIR)
 
   if ua := input.get('user_agent'):
-    api.s.headers['User-Agent'] = ua
+    api._s.set_user_agent(ua)
 
   r: dict[str, Any]
   try:
@@ -6,13 +6,25 @@ import json
 import signal
 import sys
 import tempfile
+import threading
+import time
 
 from .typing import PkgToBuild, Rusages
 from .cmd import git_pull_override
-from .tools import has_pacfiles
+from .tools import has_pacfiles, ResourceSampler, ResourceStats
+from .const import _G, mydir
+from . import forkserver
 
 logger = logging.getLogger(__name__)
 
+# thresholds for cpu_ratio from get_resource_usage
+CPU_OVERLOADED = 1.0
+CPU_BUSY = 0.9
+# wake up the scheduler when this much more memory becomes available
+MEMORY_FREED_STEP = 1024 ** 3
+# stats from a remote resource agent older than this are not used
+AGENT_STATS_TTL = 10
+
 class ResourceTemporarilyOverloaded(Exception):
   pass
 
@@ -21,6 +33,8 @@ class WorkerManager:
   max_concurrency: int
   workers_before_me: int = 0
   current_task_count: int = 0
+  # add CPU pressure to the CPU usage ratio
+  cpu_pressure: bool = False
 
   def get_worker_cmd(self, pkgbase: str) -> list[str]:
     raise NotImplementedError
@@ -40,19 +54,32 @@ class WorkerManager:
   def finish_batch(self) -> None:
     raise NotImplementedError
 
+  def start_monitoring(self, wakeup: threading.Event) -> None:
+    '''set `wakeup` when resources become available
+
+    Worker managers that don't support this are polled periodically instead.
+    '''
+    pass
+
+  def stop_monitoring(self) -> None:
+    pass
+
   def try_accept_package(
     self,
     ready_to_build: list[str],
     rusages: Rusages,
     priority_func: Callable[[str], int],
     check_buildability: Callable[[str], Optional[PkgToBuild]],
+    critical_path_func: Optional[Callable[[str], float]] = None,
   ) -> list[PkgToBuild]:
+    '''critical_path_func: if given, packages with the same priority are
+    ordered by it, longest first'''
     if self.current_task_count >= self.max_concurrency:
       return []
 
     cpu_ratio, memory_avail = self.get_resource_usage()
 
-    if cpu_ratio > 1.0 and self.current_task_count > 0:
+    if cpu_ratio > CPU_OVERLOADED and self.current_task_count > 0:
       logger.debug('[%s] high CPU usage (%.2f), idling', self.name, cpu_ratio)
       raise ResourceTemporarilyOverloaded
 
@@ -63,12 +90,16 @@ class WorkerManager:
         cpu = r.cputime / r.elapsed
       else:
         cpu = 1.0
+      if critical_path_func is not None:
+        return (p, -critical_path_func(pkg), cpu)
       return (p, cpu)
     ready_to_build.sort(key=sort_key)
     logger.debug('[%s] sorted ready_to_build: %r',
                  self.name, ready_to_build)
 
-    if cpu_ratio < 0.9:
+    if cpu_ratio >= CPU_BUSY:
+      logger.info('high cpu usage (%.2f), preferring low-cpu-usage builds', cpu_ratio)
+    elif critical_path_func is None:
       # low cpu usage, build a big package
       p = priority_func(ready_to_build[0])
       for idx, pkg in enumerate(ready_to_build):
@@ -76,8 +107,6 @@ class WorkerManager:
           if idx > 2:
             ready_to_build.insert(0, ready_to_build.pop(idx-1))
           break
-    else:
-      logger.info('high cpu usage (%.2f), preferring low-cpu-usage builds', cpu_ratio)
 
     ret: list[PkgToBuild] = []
 
@@ -113,36 +142,73 @@ class WorkerManager:
   def from_name(config: dict[str, Any], name: str):
     if name == 'local':
       max_concurrency = config['lilac'].get('max_concurrency', 1)
-      return LocalWorkerManager(max_concurrency)
+      use_forkserver = config['lilac'].get('forkserver', False)
+      wm: WorkerManager = LocalWorkerManager(max_concurrency, use_forkserver)
     else:
       remote = [
         x for x in config['remoteworker']
         if x.get('enabled', False) and x['name'] == name
       ][0]
-      return RemoteWorkerManager(remote)
+      wm = RemoteWorkerManager(remote)
+    wm.cpu_pressure = config['lilac'].get('cpu_pressure', False)
+    return wm
+
+class ResourceWatcher:
+  '''decide whether new samples of resource usage should wake up the scheduler
+
+  It looks at the same usage try_accept_package does.
+  '''
+  def __init__(self, wakeup: threading.Event, cpu_pressure: bool = False) -> None:
+    self.wakeup = wakeup
+    self.cpu_pressure = cpu_pressure
+    self.cpu_ratio = 0.0
+    self.memory_avail: Optional[int] = None
+
+  def update(self, stats: ResourceStats) -> None:
+    cpu_ratio, memory_avail = stats.usage(self.cpu_pressure)
+    freed = False
+    if cpu_ratio <= CPU_OVERLOADED < self.cpu_ratio:
+      # no longer refused for CPU usage
+      freed = True
+    if self.memory_avail is None or memory_avail < self.memory_avail:
+      # track the low point so that a gradual increase is noticed too
+      self.memory_avail = memory_avail
+    elif memory_avail - self.memory_avail >= MEMORY_FREED_STEP:
+      freed = True
+      self.memory_avail = memory_avail
+    self.cpu_ratio = cpu_ratio
+
+    if freed:
+      logger.debug('resources freed (cpu %.2f, memory %d), waking up scheduler',
+                   cpu_ratio, memory_avail)
+      self.wakeup.set()
 
 class LocalWorkerManager(WorkerManager):
   name: str = 'local'
   max_concurrency: int
+  sampler: Optional[ResourceSampler] = None
+  forkserver: Optional[subprocess.Popen] = None
 
-  def __init__(self, max_concurrency) -> None:
+  def __init__(self, max_concurrency, use_forkserver: bool = False) -> None:
     self.max_concurrency = max_concurrency
+    self.use_forkserver = use_forkserver
+    self.forkserver_sock = str(mydir / 'forkserver.sock')
 
   @override
   def get_worker_cmd(self, pkgbase: str) -> list[str]:
-    return [
-      sys.executable,
-      '-Xno_debug_ranges', # save space
-      '-P', # don't prepend cwd to sys.path where unexpected directories may exist
-      '-m', 'lilac2.worker', pkgbase,
-    ]
+    if self.forkserver is not None and self.forkserver.poll() is None:
+      return forkserver.client_cmd(self.forkserver_sock, pkgbase)
+    return forkserver.worker_cmd(pkgbase)
 
   @override
   def get_resource_usage(self) -> tuple[float, int]:
+    if self.sampler is not None:
+      stats = self.sampler.get_stats()
+      logger.debug('[%s] resource stats: %r', self.name, stats)
+      return stats.usage(self.cpu_pressure)
+
     from . import tools
-    cpu_ratio = tools.get_running_task_cpu_ratio()
-    memory_avail = tools.get_avail_memory()
-    return cpu_ratio, memory_avail
+    return tools.get_resource_usage(self.cpu_pressure)
 
   @override
   def sync_depended_packages(self, depends: list[str]) -> None:
@@ -156,10 +222,54 @@ class LocalWorkerManager(WorkerManager):
     from . import pkgbuild
     logger.info('[%s] updating pacman databases', self.name)
     pkgbuild.update_data(pacman_conf, update_pacfiles=has_pacfiles())
+    if self.use_forkserver:
+      # after update_data so that it loads the new data
+      self.start_forkserver()
 
   @override
   def finish_batch(self) -> None:
-    pass
+    self.stop_forkserver()
+
+  def start_forkserver(self) -> None:
+    self.stop_forkserver()
+    p = subprocess.Popen(
+      [sys.executable, '-Xno_debug_ranges', '-P', '-m', 'lilac2.forkserver',
+       'serve', self.forkserver_sock, _G.reponame],
+      stdin = subprocess.PIPE,
+      stdout = subprocess.PIPE,
+    )
+    assert p.stdout
+    if p.stdout.readline() == b'ready\n':
+      logger.info('[%s] forkserver started', self.name)
+      self.forkserver = p
+    else:
+      logger.error('[%s] forkserver failed to start, starting workers directly', self.name)
+      p.kill()
+      p.wait()
+
+  def stop_forkserver(self) -> None:
+    if (p := self.forkserver) is None:
+      return
+    self.forkserver = None
+    assert p.stdin
+    p.stdin.close()
+    try:
+      p.wait(10)
+    except subprocess.TimeoutExpired:
+      p.kill()
+      p.wait()
+
+  @override
+  def start_monitoring(self, wakeup: threading.Event) -> None:
+    watcher = ResourceWatcher(wakeup, self.cpu_pressure)
+    self.sampler = ResourceSampler(watcher.update)
+    self.sampler.start()
+
+  @override
+  def stop_monitoring(self) -> None:
+    if self.sampler is not None:
+      self.sampler.stop()
+      self.sampler = None
 
 class RemoteWorkerManager(WorkerManager):
   name: str
@@ -167,6 +277,9 @@ class RemoteWorkerManager(WorkerManager):
   repodir: str
   host: str
   config: dict[str, Any]
+  agent: Optional[subprocess.Popen] = None
+  # (time.monotonic(), stats) last received from the agent
+  agent_stats: Optional[tuple[float, ResourceStats]] = None
 
   def __init__(self, remote: dict[str, Any]) -> None:
     self.name = remote['name']
@@ -186,7 +299,12 @@ class RemoteWorkerManager(WorkerManager):
 
   @override
   def get_resource_usage(self) -> tuple[float, int]:
+    if (s := self.agent_stats) and time.monotonic() - s[0] < AGENT_STATS_TTL:
+      return s[1].usage(self.cpu_pressure)
+
     sshcmd = self.get_sshcmd_prefix() + ['python', '-m', 'lilac2.tools']
+    if self.cpu_pressure:
+      sshcmd.append('--cpu-pressure')
     out = subprocess.check_output(sshcmd, text=True)
     cpu, mem = out.split()
     return float(cpu), int(mem)
@@ -215,7 +333,7 @@ class RemoteWorkerManager(WorkerManager):
     # update pacman databases
     sshcmd = self.get_sshcmd_prefix() + [
       'python', '-Xno_debug_ranges', '-P',
-      '-m', 'lilac2.pkgbuild', pacman_conf or '',
+      '-m', 'lilac2.pkgbuild', pacman_conf or '', _G.reponame,
     ]
     logger.info('[%s] running %s', self.name, sshcmd)
     subprocess.check_call(sshcmd)
@@ -251,6 +369,53 @@ class RemoteWorkerManager(WorkerManager):
     if postrun := self.config.get('postrun'):
       self.run_cmds(postrun)
 
+  @override
+  def start_monitoring(self, wakeup: threading.Event) -> None:
+    sshcmd = self.get_sshcmd_prefix() + [
+      'python', '-Xno_debug_ranges', '-P', '-m', 'lilac2.tools', '--stream',
+    ]
+    logger.info('[%s] starting resource agent: %s', self.name, sshcmd)
+    self.agent = subprocess.Popen(
+      sshcmd,
+      stdin = subprocess.PIPE,
+      stdout = subprocess.PIPE,
+      text = True,
+    )
+    t = threading.Thread(
+      target = self._read_agent,
+      args = (self.agent, ResourceWatcher(wakeup, self.cpu_pressure)),
+      name = f'resource-agent-{self.name}',
+      daemon = True,
+    )
+    t.start()
+
+  def _read_agent(self, p: subprocess.Popen, watcher: ResourceWatcher) -> None:
+    assert p.stdout
+    for line in p.stdout:
+      try:
+        stats = ResourceStats(**json.loads(line))
+      except (ValueError, TypeError):
+        logger.warning('[%s] bad output from resource agent: %r', self.name, line)
+        continue
+      self.agent_stats = time.monotonic(), stats
+      watcher.update(stats)
+
+    logger.info('[%s] resource agent exited', self.name)
+    self.agent_stats = None
+
+  @override
+  def stop_monitoring(self) -> None:
+    if p := self.agent:
+      self.agent = None
+      assert p.stdin
+      p.stdin.close()
+      try:
+        p.wait(5)
+      except subprocess.TimeoutExpired:
+        p.terminate()
+        p.wait()
+    self.agent_stats = None
+
   def fetch_files(self, pkgname: str) -> None:
     # run in remote.worker
     rsync_cmd = [
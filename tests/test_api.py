@@ -37,3 +37,16 @@ def test_allow_update_aur_repo(pkgname, commit_sha1, expected):
   with open(f'tests/fixtures/{pkgname}-{commit_sha1}.diff') as f:
     diff = f.read()
   assert _allow_update_aur_repo(pkgname, diff) == expected
+
+def test_obtain_array_returns_copies(tmp_path, monkeypatch):
+  from lilac2 import api, pkgbuild
+
+  (tmp_path / 'PKGBUILD').write_text('depends=(a b)\n')
+  monkeypatch.chdir(tmp_path)
+  monkeypatch.setattr(pkgbuild, '_eval_cache', {})
+  monkeypatch.setattr(pkgbuild, '_evaluate', lambda scalars, arrays: pkgbuild.PkgbuildValues(
+    dict.fromkeys(scalars), {a: ['a', 'b'] if a == 'depends' else None for a in arrays},
+  ))
+  deps = api.obtain_depends()
+  deps.remove('a')
+  assert api.obtain_depends() == ['a', 'b']
@@ -0,0 +1,42 @@
+from lilac2.checkpoint import BatchCheckpoint
+from lilac2.nvchecker import NvResults, NvResult
+
+def vers(*newvers):
+  return NvResults([NvResult('0', v) for v in newvers])
+
+def test_resume(tmp_path):
+  path = tmp_path / 'checkpoint.json'
+  c = BatchCheckpoint(path)
+  assert c.start([], 'commit1') == 'commit1'
+  c.build_started('a')
+  c.build_finished('a', vers('1'), True)
+  c.build_started('b')
+  c.build_finished('b', vers('2'), False, ('x',))
+  c.build_started('c')
+
+  # interrupted here
+  c = BatchCheckpoint(path)
+  assert c.start([], 'commit2') == 'commit1'
+  assert c.interrupted == {'c'}
+  assert c.skip_done('a', vers('1'))
+  assert c.failed['b'][0] == ('x',)
+  # a newer version has come out
+  assert not c.skip_done('b', vers('3'))
+  assert not c.skip_done('c', vers('1'))
+  assert c.skipped == {'a'}
+
+  c.clear()
+  assert not path.exists()
+  c = BatchCheckpoint(path)
+  assert c.start([], 'commit2') == 'commit2'
+  assert not c.skip_done('a', vers('1'))
+
+def test_other_batch(tmp_path):
+  path = tmp_path / 'checkpoint.json'
+  c = BatchCheckpoint(path)
+  c.start(['a'], 'commit1')
+  c.build_finished('a', vers('1'), True)
+
+  c = BatchCheckpoint(path)
+  assert c.start([], 'commit2') == 'commit2'
+  assert not c.built
@@ -0,0 +1,63 @@
+import re
+import subprocess
+
+import pytest
+
+from lilac2.cmd import OutputCapture, run_cmd
+
+def old_cleanup(b):
+  s = b.decode('utf-8', errors='replace')
+  s = s.replace('\r\n', '\n')
+  return re.sub(r'.*\r', '', s)
+
+@pytest.mark.parametrize('chunk', [1, 2, 3, 7, 4096])
+def test_capture_streamed(chunk):
+  data = (
+    'progress 1%\rprogress 50%\rprogress 100%\r\ndone\n'
+    '中文\r\r\nx\ry\rz\nno newline\r'
+  ).encode()
+  c = OutputCapture()
+  for i in range(0, len(data), chunk):
+    c.feed(data[i:i+chunk])
+  c.feed(b'', final=True)
+  assert c.getvalue() == old_cleanup(data)
+
+def test_capture_head_tail():
+  c = OutputCapture(head=10, tail=10)
+  for i in range(100):
+    c.feed(b'%09d\n' % i)
+  c.feed(b'', final=True)
+  assert c.omitted == 980
+  out = c.getvalue()
+  assert out.startswith('000000000\n')
+  assert out.endswith('000000099\n')
+  assert '000000050' not in out
+
+def test_run_cmd():
+  assert run_cmd(['sh', '-c', 'printf "a\\rb\\n"'], silent=True) == 'b\n'
+  with pytest.raises(subprocess.CalledProcessError) as e:
+    run_cmd(['sh', '-c', 'echo failed; exit 3'], silent=True)
+  assert e.value.output == 'failed\n'
+
+def test_run_cmd_pty():
+  assert run_cmd(['echo', 'hi'], use_pty=True, silent=True) == 'hi\n'
+
+def test_capture_keep_all():
+  c = OutputCapture(head=10, tail=10, keep_all=True)
+  for i in range(100):
+    c.feed(b'%09d\n' % i)
+  c.feed(b'', final=True)
+  assert len(c.getvalue(bounded=False)) == 1000
+  out = c.getvalue()
+  assert out.startswith('000000000\n')
+  assert out.endswith('000000099\n')
+  assert '000000050' not in out
+
+def test_run_cmd_output_limit():
+  # about 15 MB
+  cmd = ['seq', '2000000']
+  out = run_cmd(cmd, silent=True)
+  assert out.startswith('1\n2\n')
+  assert out.endswith('1999999\n2000000\n')
+  assert len(out) < 9 * 1024 ** 2
+  assert run_cmd(cmd, silent=True, keep_all=True).count('\n') == 2000000
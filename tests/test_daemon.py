@@ -0,0 +1,40 @@
+from lilac2 import daemon
+
+def test_requests():
+  r = daemon.Requests()
+  assert r.wait(0) is None
+
+  r.submit(['a', 'b'])
+  r.request_full()
+  r.submit(['b', 'c'])
+  # full batch first, packages stay queued
+  assert r.wait(0) == []
+  assert r.wait(0) == ['a', 'b', 'c']
+  assert r.wait(0) is None
+
+def test_take():
+  r = daemon.Requests()
+  woken = []
+  r.set_listener(lambda: woken.append(True))
+  assert r.take(lambda pkgs: pkgs) == []
+
+  r.submit(['a', 'b', 'c'])
+  assert woken == [True]
+  r.request_full()
+  assert woken == [True]
+  assert r.take(lambda pkgs: [p for p in pkgs if p != 'b']) == ['a', 'c']
+  assert r.wait(0) == []
+  assert r.wait(0) == ['b']
+
+def test_submit(tmp_path):
+  r = daemon.Requests()
+  path = tmp_path / 'lilac.sock'
+  server = daemon.start_server(path, r)
+  try:
+    assert daemon.submit(path, ['a', 'b:runner']) == 'queued 2 package(s)\n'
+    assert r.wait(5) == ['a', 'b:runner']
+    assert daemon.submit(path, []) == 'queued a full batch\n'
+    assert r.wait(5) == []
+  finally:
+    server.shutdown()
+    server.server_close()
@@ -1,7 +1,10 @@
 from collections import namedtuple
 from pathlib import Path
+import subprocess
 
-from lilac2.packages import DependencyManager, get_dependency_map
+from lilac2.packages import (
+  DependencyManager, get_dependency_map, built_packages, get_changed_packages,
+)
 
 def test_dependency_map():
   depman = DependencyManager(Path('.'))
@@ -39,3 +42,78 @@ def test_dependency_map():
     return { key: { val.pkgdir.name for val in s } for key, s in m.items() }
   assert parse_map(res_all) == expected_all
   assert parse_map(res_build) == expected_build
+  # like a defaultdict, but without adding the key
+  assert res_all['nonexistent'] == set()
+  assert 'nonexistent' not in res_all
+
+def test_resolve_built_package(tmp_path):
+  pkgdir = tmp_path / 'foo'
+  pkgdir.mkdir()
+  (pkgdir / 'foo-1.0-1-x86_64.pkg.tar.zst').touch()
+  (pkgdir / 'foo-debug-1.0-1-x86_64.pkg.tar.zst').touch()
+  (pkgdir / 'PKGBUILD').touch()
+
+  depman = DependencyManager(tmp_path)
+  assert depman.get('foo').resolve() == pkgdir / 'foo-1.0-1-x86_64.pkg.tar.zst'
+  assert depman.get(('foo', 'bar')).resolve() is None
+  assert depman.get('nonexistent').resolve() is None
+
+  # cached until invalidated
+  (pkgdir / 'foo-1.0-1-x86_64.pkg.tar.zst').unlink()
+  (pkgdir / 'foo-1.1-1-x86_64.pkg.tar.zst').touch()
+  assert depman.get('foo').resolve() == pkgdir / 'foo-1.0-1-x86_64.pkg.tar.zst'
+  built_packages.invalidate(pkgdir)
+  assert depman.get('foo').resolve() == pkgdir / 'foo-1.1-1-x86_64.pkg.tar.zst'
+
+def test_get_changed_packages(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  def git(*args):
+    subprocess.run(
+      ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+      check=True, capture_output=True,
+    )
+  def write(path, content):
+    p = tmp_path / path
+    p.parent.mkdir(exist_ok=True)
+    p.write_text(content)
+
+  git('init', '-q')
+  for pkg in ['a', 'b', 'c', 'd e']:
+    write(f'{pkg}/PKGBUILD', 'pkgver=1\npkgrel=1\n')
+  git('add', '.')
+  git('commit', '-q', '-m', 'init')
+
+  write('a/PKGBUILD', 'pkgver=1\npkgrel=2\n')
+  write('b/lilac.yaml', 'maintainers: []\n')
+  write('c/sub/PKGBUILD', 'pkgrel=1\n')
+  write('d e/PKGBUILD', 'pkgver=1\npkgrel=3\n')
+  git('add', '.')
+  git('commit', '-q', '-m', 'update')
+
+  changed, pkgrel_changed = get_changed_packages('HEAD^', 'HEAD')
+  assert changed == {'a', 'b', 'c', 'd e'}
+  assert pkgrel_changed == {'a', 'd e'}
+
+def test_get_changed_packages_not_utf8(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  def git(*args):
+    subprocess.run(
+      ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+      check=True, capture_output=True,
+    )
+
+  git('init', '-q')
+  for pkg in ['a', 'b']:
+    (tmp_path / pkg).mkdir()
+    (tmp_path / pkg / 'PKGBUILD').write_text('pkgver=1\npkgrel=1\n')
+  git('add', '.')
+  git('commit', '-q', '-m', 'init')
+
+  (tmp_path / 'a' / 'PKGBUILD').write_bytes(b'# caf\xe9\npkgver=1\npkgrel=2\n')
+  (tmp_path / 'b' / 'fix.patch').write_bytes(b'caf\xe9\n')
+  git('add', '.')
+  git('commit', '-q', '-m', 'update')
+
+  changed, pkgrel_changed = get_changed_packages('HEAD^', 'HEAD')
+  assert changed == {'a', 'b'}
+  assert pkgrel_changed == {'a'}
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import signal
+import pathlib
+import subprocess
+
+import pytest
+
+from lilac2 import forkserver
+
+# a server with a stand-in worker and no package data
+SERVER_CODE = '''\
+import os, sys, time, types, signal, socket, subprocess
+sys.path.insert(0, sys.argv[2])
+
+def main(data_loaded):
+  what = sys.argv[1]
+  if what == 'exit':
+    sys.exit(3)
+  elif what == 'signal':
+    os.kill(os.getpid(), signal.SIGTERM)
+  elif what == 'hang':
+    p = subprocess.Popen(['sleep', '60'])
+    with open(os.environ['PIDFILE'], 'w') as f:
+      f.write(f'{os.getpid()} {p.pid}')
+    p.wait()
+
+worker = types.ModuleType('lilac2.worker')
+worker.main = main
+sys.modules['lilac2.worker'] = worker
+
+from lilac2 import forkserver
+signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(sys.argv[1])
+server.listen()
+print('ready', flush=True)
+forkserver._serve(server)
+'''
+
+@pytest.fixture
+def server(tmp_path):
+  path = str(tmp_path / 'forkserver.sock')
+  root = str(pathlib.Path(__file__).resolve().parents[1])
+  p = subprocess.Popen(
+    [sys.executable, '-c', SERVER_CODE, path, root],
+    stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+  )
+  assert p.stdout.readline() == b'ready\n' # type: ignore
+  yield path
+  p.stdin.close() # type: ignore
+  p.wait(10)
+
+def _alive(pid: int) -> bool:
+  try:
+    with open(f'/proc/{pid}/stat') as f:
+      return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+  except FileNotFoundError:
+    return False
+
+def _client(path: str, pkgbase: str, **kwargs) -> subprocess.Popen:
+  return subprocess.Popen(
+    forkserver.client_cmd(path, pkgbase),
+    stdin = subprocess.DEVNULL,
+    stderr = subprocess.PIPE,
+    **kwargs,
+  )
+
+def test_exit_status(server):
+  p = _client(server, 'exit')
+  _, err = p.communicate(timeout=10)
+  assert p.returncode == 3
+  assert b'worker exited: status 768' in err
+
+def test_killed_by_signal(server):
+  p = _client(server, 'signal')
+  p.communicate(timeout=10)
+  assert p.returncode == -signal.SIGTERM
+
+def test_client_killed(server, tmp_path):
+  pidfile = tmp_path / 'pids'
+  p = _client(server, 'hang', env = os.environ | {'PIDFILE': str(pidfile)})
+  for _ in range(100):
+    if pidfile.exists() and pidfile.read_text():
+      break
+    time.sleep(0.1)
+  pids = [int(x) for x in pidfile.read_text().split()]
+  assert all(_alive(pid) for pid in pids)
+
+  p.kill()
+  p.wait()
+  for _ in range(100):
+    if not any(_alive(pid) for pid in pids):
+      break
+    time.sleep(0.1)
+  assert not any(_alive(pid) for pid in pids)
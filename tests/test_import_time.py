@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+topdir = Path(__file__).resolve().parent.parent
+
+# not needed by most builds; imported when used
+LAZY_MODULES = ['httpx', 'lxml', 'fluent.runtime', 'pyalpm', 'multiprocessing']
+
+CODE = '''\
+import sys, time, json
+t = time.perf_counter()
+import lilac2.worker
+t = time.perf_counter() - t
+# what lilac.py files do
+from lilaclib import *
+# modules imported lazily are in sys.modules but not executed yet
+loaded = [name for name, m in sys.modules.items()
+          if type(m).__name__ != '_LazyModule']
+print(json.dumps([t, loaded]))
+'''
+
+def test_worker_import_time():
+  times = []
+  for _ in range(3):
+    out = subprocess.check_output(
+      [sys.executable, '-c', CODE], cwd=topdir, text=True)
+    t, modules = json.loads(out)
+    times.append(t)
+  print(f'importing lilac2.worker took {min(times) * 1000:.1f}ms')
+
+  loaded = [m for m in LAZY_MODULES if m in modules]
+  assert not loaded, f'{loaded} imported by lilac2.worker'
+
+def test_lazy_names():
+  import httpx
+  import lilaclib
+
+  assert callable(lilaclib.gen_pkgbuild)
+  assert callable(lilaclib.parse_document_from_httpx)
+  assert lilaclib.httpx.Client is httpx.Client
+  assert callable(lilaclib.mediawiki2pkgbuild.gen_pkgbuild)
+  assert callable(lilaclib.tempfile.mkdtemp)
+
+WORKER_CODE = '''\
+import sys, json
+from lilac2 import worker
+worker.main(data_loaded=True)
+loaded = [name for name, m in sys.modules.items()
+          if type(m).__name__ != '_LazyModule']
+with open(sys.argv[1], 'w') as f:
+  json.dump(loaded, f)
+'''
+
+def test_worker_run(tmp_path):
+  # kill_children is called at the end
+  bindir = tmp_path / 'bin'
+  bindir.mkdir()
+  (bindir / 'kill_children').write_text('#!/bin/sh\n')
+  (bindir / 'kill_children').chmod(0o755)
+  pkgdir = tmp_path / 'pkg'
+  pkgdir.mkdir()
+  env = {
+    **os.environ,
+    'PATH': f'{bindir}:{os.environ["PATH"]}',
+    'PYTHONPATH': os.pathsep.join([str(topdir), os.environ.get('PYTHONPATH', '')]),
+  }
+
+  input = {
+    'commit_msg_template': '',
+    'reponame': 'test',
+    'result': str(tmp_path / 'result.json'),
+    'worker_no': 0,
+    'depend_packages': [],
+    'update_info': [],
+    'bindmounts': {},
+    'tmpfs': [],
+    'user_agent': 'lilac/test',
+  }
+  subprocess.run(
+    [sys.executable, '-c', WORKER_CODE, tmp_path / 'modules.json'],
+    input = json.dumps(input), text = True, cwd = pkgdir, env = env,
+    check = True, capture_output = True,
+  )
+  # no lilac.yaml
+  assert json.loads((tmp_path / 'result.json').read_text())['status'] == 'failed'
+  modules = json.loads((tmp_path / 'modules.json').read_text())
+  # setting the user agent doesn't create the client
+  loaded = [m for m in ['httpx', 'h2'] if m in modules]
+  assert not loaded, f'{loaded} imported by a worker run'
+
+def test_user_agent():
+  from lilac2.api import _LazyClient
+
+  c = _LazyClient()
+  c.set_user_agent('lilac/test')
+  assert c.headers['User-Agent'] == 'lilac/test'
@@ -0,0 +1,80 @@
+import subprocess
+
+from lilac2 import lilacyaml
+from lilac2.const import _G
+
+def _commit(repodir):
+  subprocess.check_call(['git', 'add', '.'], cwd=repodir)
+  subprocess.check_call([
+    'git', '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+    'commit', '-q', '-m', 'update',
+  ], cwd=repodir)
+
+def test_lilacinfo_cache(tmp_path, monkeypatch):
+  monkeypatch.setattr(_G, 'reponame', 'testrepo', raising=False)
+  repodir = tmp_path / 'repo'
+  repodir.mkdir()
+  subprocess.check_call(['git', 'init', '-q'], cwd=repodir)
+  for name in ['A', 'B']:
+    (repodir / name).mkdir()
+    (repodir / name / 'lilac.yaml').write_text(
+      'update_on:\n  - source: aur\n')
+  _commit(repodir)
+
+  cache = tmp_path / 'lilacinfos.cache'
+  infos, errors = lilacyaml.load_managed_lilacinfos(repodir, cache_file=cache)
+  assert not errors
+  assert set(infos) == {'A', 'B'}
+
+  calls = []
+  orig = lilacyaml.load_and_check_lilacinfo
+  def load_and_check_lilacinfo(dir, **kwargs):
+    calls.append(dir.name)
+    return orig(dir, **kwargs)
+  monkeypatch.setattr(
+    lilacyaml, 'load_and_check_lilacinfo', load_and_check_lilacinfo)
+
+  infos2, _ = lilacyaml.load_managed_lilacinfos(repodir, cache_file=cache)
+  assert calls == []
+  assert infos2 == infos
+
+  (repodir / 'B' / 'lilac.yaml').write_text('managed: false\n')
+  infos3, _ = lilacyaml.load_managed_lilacinfos(repodir, cache_file=cache)
+  assert calls == ['B']
+  assert set(infos3) == {'A'}
+
+  _commit(repodir)
+  calls.clear()
+  infos4, _ = lilacyaml.load_managed_lilacinfos(repodir, cache_file=cache)
+  assert calls == ['B']
+  assert set(infos4) == {'A'}
+
+def test_check_lilac_parallel(tmp_path, monkeypatch):
+  monkeypatch.setattr(_G, 'reponame', 'testrepo', raising=False)
+  monkeypatch.setattr(lilacyaml, '_PARALLEL_THRESHOLD', 0)
+  for i in range(10):
+    d = tmp_path / f'good{i}'
+    d.mkdir()
+    (d / 'lilac.yaml').write_text('pre_build_script: update_pkgver_and_pkgrel(_G.newver)\n')
+    (d / 'lilac.py').write_text('def post_build():\n  pass\n')
+
+  d = tmp_path / 'badpy'
+  d.mkdir()
+  (d / 'lilac.yaml').write_text('maintainers: []\n')
+  (d / 'lilac.py').write_text('def pre_build(:\n')
+
+  d = tmp_path / 'badscript'
+  d.mkdir()
+  (d / 'lilac.yaml').write_text('post_build_script: git_pkgbuild_commit(\n')
+
+  d = tmp_path / 'badyaml'
+  d.mkdir()
+  (d / 'lilac.yaml').write_text('update_on: [\n')
+
+  infos, errors = lilacyaml.load_managed_lilacinfos(tmp_path, jobs=2)
+  assert set(infos) == {f'good{i}' for i in range(10)}
+  assert set(errors) == {'badpy', 'badscript', 'badyaml'}
+  exc = errors['badpy'][1]
+  assert isinstance(exc, SyntaxError)
+  assert exc.filename.endswith('lilac.py')
+  assert isinstance(errors['badscript'][1], SyntaxError)
@@ -0,0 +1,47 @@
+import pytest
+
+from lilac2.logexcerpt import read_log_excerpt
+
+def test_small(tmp_path):
+  log = tmp_path / 'log'
+  log.write_bytes('all of it\nerror: 中文\n'.encode())
+  e = read_log_excerpt(log)
+  assert e.head == 'all of it\nerror: 中文\n'
+  assert e.tail is None
+  assert e.error is None
+
+def test_large(tmp_path):
+  log = tmp_path / 'log'
+  lines = [f'line {i} 中文\n' for i in range(10000)]
+  lines[5000] = 'foo.cpp:1:2: error: bar\n'
+  lines[6000] = 'error[E0425]: not the first\n'
+  log.write_text(''.join(lines))
+
+  e = read_log_excerpt(log, head=1000, tail=1000, before=2, after=1)
+  assert e.tail is not None
+  assert ''.join(lines).startswith(e.head)
+  assert ''.join(lines).endswith(e.tail)
+  # cut at character boundaries
+  assert '�' not in e.head + e.tail
+  assert e.error == ''.join(lines[4998:5002])
+
+def test_error_in_head(tmp_path):
+  log = tmp_path / 'log'
+  log.write_text('==> ERROR: failed\n' + 'x' * 10000)
+  e = read_log_excerpt(log, head=100, tail=100)
+  assert e.error is None
+
+@pytest.mark.parametrize('line', [
+  # gcc
+  '\x1b[01m\x1b[Kfoo.cpp:1:2:\x1b[m\x1b[K \x1b[01;31m\x1b[Kerror: \x1b[m\x1b[Kbar\n',
+  # rustc
+  '\x1b[0m\x1b[1m\x1b[38;5;9merror[E0425]\x1b[0m\x1b[0m\x1b[1m: cannot find value\x1b[0m\n',
+])
+def test_coloured_error(tmp_path, line):
+  log = tmp_path / 'log'
+  lines = [f'line {i}\n' for i in range(1000)]
+  lines[400] = 'warning: -Werror=foo is not an error\n'
+  lines[500] = line
+  log.write_text(''.join(lines))
+  e = read_log_excerpt(log, head=100, tail=100, before=0, after=0)
+  assert e.error == line
@@ -0,0 +1,156 @@
+import gzip
+import time
+import smtplib
+import threading
+
+import pytest
+
+from lilac2.mail import MailService
+
+CONFIG = {
+  'smtp': {},
+  'lilac': {
+    'name': 'lilac',
+    'email': 'lilac@example.com',
+    'send_email': True,
+  },
+}
+
+class FakeSMTP:
+  def __init__(self, sent, fail):
+    self.sent = sent
+    self.fail = fail
+
+  def noop(self):
+    pass
+
+  def send_message(self, mail):
+    if self.fail:
+      self.fail.pop()
+      raise smtplib.SMTPServerDisconnected('gone')
+    if mail['To'] == 'bad@example.com':
+      raise smtplib.SMTPRecipientsRefused({'bad@example.com': (550, b'no')})
+    if mail['To'] == 'busy@example.com':
+      raise smtplib.SMTPDataError(451, b'try again later')
+    if mail['To'] == 'broken@example.com':
+      raise ValueError('broken mail')
+    self.sent.append(mail['Subject'])
+
+  def quit(self):
+    pass
+
+  def close(self):
+    pass
+
+def make_service(spool, sent, fail=()):
+  ms = MailService(CONFIG, spool=spool)
+  fail = list(fail)
+  ms.queue._connect = lambda: FakeSMTP(sent, fail)
+  return ms
+
+def test_queue(tmp_path, monkeypatch):
+  monkeypatch.setattr('time.sleep', lambda t: None)
+  sent = []
+  ms = make_service(tmp_path, sent, fail=[1])
+  for i in range(3):
+    ms.sendmail('a@example.com', f'mail {i}', 'body')
+  ms.sendmail('bad@example.com', 'rejected', 'body')
+  assert ms.flush(timeout=10)
+  assert sent == ['[lilac] mail 0', '[lilac] mail 1', '[lilac] mail 2']
+  assert len(list((tmp_path / 'failed').iterdir())) == 1
+
+def test_queue_not_blocked(tmp_path, monkeypatch):
+  monkeypatch.setattr('time.sleep', lambda t: None)
+  sent = []
+  ms = make_service(tmp_path, sent)
+  ms.sendmail('busy@example.com', 'busy', 'body')
+  ms.sendmail('broken@example.com', 'broken', 'body')
+  ms.sendmail('a@example.com', 'mail', 'body')
+  assert ms.flush(timeout=10)
+  assert sent == ['[lilac] mail']
+  assert len(list((tmp_path / 'failed').iterdir())) == 2
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_queue_restarts(tmp_path):
+  sent = []
+  ms = make_service(tmp_path, sent)
+  queue = ms.queue
+  send = queue._send
+  dead = []
+  def send_once(files):
+    queue._send = send
+    dead.append(threading.current_thread())
+    raise SystemExit
+  queue._send = send_once
+  ms.sendmail('a@example.com', 'first', 'body')
+  while not dead:
+    time.sleep(0.01)
+  dead[0].join(10)
+  assert queue._thread is None
+
+  ms.sendmail('a@example.com', 'second', 'body')
+  assert ms.flush(timeout=10)
+  assert sent == ['[lilac] first', '[lilac] second']
+
+def test_spool_survives(tmp_path):
+  ms = MailService(CONFIG, spool=tmp_path)
+  # not started; as if lilac exited before sending
+  ms.queue._start = lambda: None
+  ms.sendmail('a@example.com', 'left over', 'body')
+
+  sent = []
+  ms = make_service(tmp_path, sent)
+  assert ms.flush(timeout=10)
+  assert sent == ['[lilac] left over']
+
+def test_digest(tmp_path):
+  from lilac2.repo import Repo
+
+  config = {
+    'lilac': {**CONFIG['lilac'], 'master': 'master@example.com', 'mail_digest': True},
+    'repository': {'email': 'repo@example.com', 'name': 'test', 'repodir': str(tmp_path)},
+    'smtp': {},
+  }
+  repo = Repo(config)
+  sent = []
+  repo.ms.sendmail = lambda *args: sent.append(args)
+  repo.find_maintainer_by_git = lambda **kwargs: 'A <a@example.com>'
+
+  repo.begin_digest()
+  logfile = tmp_path / 'foo.log'
+  logfile.write_text('build log\n')
+  repo.send_error_report('foo', msg='foo failed', subject='%s failed', logfile=logfile)
+  repo.sendmail(['a@example.com', 'b@example.com'], 'bar', 'bar failed')
+  repo.sendmail('b@example.com', 'baz', 'baz failed')
+  assert not sent
+  repo.send_digests()
+
+  by_who = {args[0]: args for args in sent}
+  who, subject, msg, attachments = by_who['A <a@example.com>']
+  assert subject == 'foo failed'
+  assert 'build log' not in msg
+  assert [(n, gzip.decompress(d)) for n, d in attachments] == [('foo.log.gz', b'build log\n')]
+  assert by_who['a@example.com'] == ('a@example.com', 'bar', 'bar failed', ())
+  who, subject, msg, attachments = by_who['b@example.com']
+  assert 'bar failed' in msg and 'baz failed' in msg
+  assert attachments == []
+
+  # mails go out directly again
+  repo.sendmail('a@example.com', 'qux', 'qux failed')
+  assert sent[-1][1] == 'qux'
+
+def test_digest_split(tmp_path, monkeypatch):
+  from lilac2 import repo as repo_mod
+
+  monkeypatch.setattr(repo_mod, 'DIGEST_MAX_SIZE', 100)
+  entries = [
+    ('a', 'x' * 40, ()),
+    ('b', 'x' * 40, ()),
+    ('c', 'x' * 40, ()),
+    ('huge', 'y' * 1000, ()),
+  ]
+  mails = repo_mod._split_digest(entries)
+  assert [[e[0] for e in m] for m in mails] == [[1, 2], [3], [4]]
+  _, _, msg, atts = mails[2][0]
+  assert 'y' not in msg
+  assert [(n, gzip.decompress(d)) for n, d in atts] == [('4-report.txt.gz', b'y' * 1000)]
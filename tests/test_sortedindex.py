@@ -0,0 +1,29 @@
+import random
+
+from lilac2.sortedindex import SortedIndex, write_index
+
+def test_lookup(tmp_path):
+  rng = random.Random(0)
+  items = {
+    f'{rng.choice("abcxyz")}pkg{rng.randrange(10**6)}': str(rng.randrange(100))
+    for _ in range(1000)
+  }
+  items['no-value'] = ''
+  path = tmp_path / 'index'
+  write_index(path, items.items())
+
+  index = SortedIndex(path)
+  for k, v in items.items():
+    assert index.get(k) == v
+    assert k in index
+    assert k[:-1] not in items or k[:-1] in index
+  for k in ['', 'a', 'zzz', 'pkg', 'apkg1x', '~']:
+    if k not in items:
+      assert index.get(k) is None
+      assert k not in index
+
+def test_empty(tmp_path):
+  path = tmp_path / 'index'
+  write_index(path, [])
+  index = SortedIndex(path)
+  assert index.get('a') is None
@@ -0,0 +1,39 @@
+import pickle
+
+from lilac2.statestore import StateStore
+
+def test_store(tmp_path):
+  path = tmp_path / 'state.sqlite'
+  store = StateStore(path)
+  assert store.get('last_commit', 'x') == 'x'
+  store.set('last_commit', 'abc')
+  store.update_failed({
+    'a': {'version': '1', 'missing': ('b', 'c')},
+    'd': {'version': None, 'missing': ()},
+  })
+  store.update_failed({}, ['d'])
+  store.update_fingerprints({'a': 'fp1', 'b': 'fp2'}, ['c'])
+  store.update_fingerprints({'a': 'fp3'}, ['b'])
+  store.close()
+
+  store = StateStore(path)
+  assert store.get('last_commit') == 'abc'
+  assert store.get_failed() == {'a': {'version': '1', 'missing': ('b', 'c')}}
+  assert store.get_fingerprints() == {'a': 'fp3'}
+  store.close()
+
+def test_import_pickled(tmp_path):
+  old = tmp_path / 'store'
+  with open(old, 'wb') as f:
+    pickle.dump({
+      'last_commit': 'abc',
+      'failed': {'a': {'version': '1', 'missing': ('b',)}},
+    }, f)
+
+  store = StateStore(tmp_path / 'state.sqlite')
+  store.import_pickled(old)
+  assert not old.exists()
+  assert store.get('last_commit') == 'abc'
+  assert store.get_failed() == {'a': {'version': '1', 'missing': ('b',)}}
+  assert store.get_fingerprints() == {}
+  store.close()
@@ -0,0 +1,27 @@
+import threading
+
+from lilac2.tools import ResourceStats
+from lilac2.workerman import ResourceWatcher
+
+def stats(cpu, pressure=0.0, memory=8 * 1024 ** 3):
+  return ResourceStats(
+    cpu_ratio = cpu, cpu_ratio_avg = cpu,
+    memory_avail = memory, memory_avail_min = memory,
+    cpu_pressure = pressure, memory_pressure = 0.0,
+  )
+
+def test_wakeup_on_pressure():
+  wakeup = threading.Event()
+  w = ResourceWatcher(wakeup, cpu_pressure=True)
+  w.update(stats(0.95, pressure=30))
+  assert not wakeup.is_set()
+  # busy but no longer overloaded
+  w.update(stats(0.95, pressure=0))
+  assert wakeup.is_set()
+
+def test_no_wakeup_while_overloaded():
+  wakeup = threading.Event()
+  w = ResourceWatcher(wakeup, cpu_pressure=True)
+  w.update(stats(1.0, pressure=50))
+  w.update(stats(0.5, pressure=60))
+  assert not wakeup.is_set()